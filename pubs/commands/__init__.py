@@ -16,4 +16,4 @@ from . import import_cmd
 from . import websearch_cmd
 
 from . import edit_cmd
-# from . import update_cmd
+from . import update_cmd
@@ -2,7 +2,6 @@ from ..paper import Paper
 from .. import repo
 from ..configs import config
 from ..uis import get_ui
-from ..endecoder import EnDecoder
 from ..utils import resolve_citekey
 
 
@@ -25,7 +24,7 @@ def command(args):
     citekey = resolve_citekey(rp, args.citekey, ui=ui, exit_on_fail=True)
     paper = rp.pull_paper(citekey)
 
-    coder = EnDecoder()
+    coder = rp.databroker.endecoder
     if meta:
         encode = coder.encode_metadata
         decode = coder.decode_metadata
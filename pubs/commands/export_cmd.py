@@ -3,6 +3,7 @@ from __future__ import print_function
 from .. import repo
 from ..configs import config
 from ..uis import get_ui
+from ..content import open_file
 from .. import endecoder
 
 
@@ -10,6 +11,8 @@ def parser(subparsers):
     parser = subparsers.add_parser('export', help='export bibliography')
     # parser.add_argument('-f', '--bib-format', default='bibtex',
     #         help='export format')
+    parser.add_argument('-o', '--output', default=None,
+            help='write the bibliography to this file instead of stdout')
     parser.add_argument('citekeys', nargs='*', help='one or several citekeys')
     return parser
 
@@ -23,17 +26,27 @@ def command(args):
 
     rp = repo.Repository(config())
 
-    try:
-        papers = [rp.pull_paper(c) for c in args.citekeys]
-    except repo.InvalidReference as v:
-        ui.error(v)
-        ui.exit(1)
-
-    if len(papers) == 0:
-        papers = rp.all_papers()
-    bib = {}
-    for p in papers:
-        bib[p.citekey] = p.bibdata
+    citekeys = None
+    if args.citekeys:
+        citekeys = []
+        for citekey in args.citekeys:
+            if citekey not in rp.citekeys:
+                ui.error('{} citekey not found'.format(citekey))
+                ui.exit(1)
+            if citekey not in citekeys:
+                citekeys.append(citekey)
+
+    # Papers are read, encoded and written one batch at a time, bypassing
+    # the cache snapshot, to keep the memory bounded for large libraries.
     exporter = endecoder.EnDecoder()
-    bibdata_raw = exporter.encode_bibdata(bib)
-    ui.message(bibdata_raw)
+    output = None if args.output is None else open_file(args.output, 'w')
+    try:
+        for p in rp.pull_papers(citekeys, cached=False):
+            bibdata_raw = exporter.encode_bibdata(p.bibentry) + '\n'
+            if output is None:
+                ui.message(bibdata_raw, end='')
+            else:
+                output.write(bibdata_raw)
+    finally:
+        if output is not None:
+            output.close()
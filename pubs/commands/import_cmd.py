@@ -8,7 +8,7 @@ from .. import color
 from ..paper import Paper
 from ..configs import config
 from ..uis import get_ui
-from ..content import system_path, read_file
+from ..content import system_path, open_file
 
 
 def parser(subparsers):
@@ -23,17 +23,16 @@ def parser(subparsers):
     return parser
 
 
-def many_from_path(bibpath):
-    """Extract list of papers found in bibliographic files in path.
+def iter_from_path(bibpath, workers=0):
+    """Extract the papers found in bibliographic files in path.
 
-    The behavior is to:
-        - ignore wrong entries,
-        - overwrite duplicated entries.
-    :returns: dictionary of (key, paper | exception)
-        if loading of entry failed, the excpetion is returned in the
-        dictionary in place of the paper
+    The files are decoded entry by entry, as they are read.
+    :param workers: if more than 1, the files are decoded in a pool of
+        that many worker processes.
+    :returns: generator of (key, paper | exception)
+        if loading of entry failed, the exception is yielded in place
+        of the paper
     """
-    coder = endecoder.EnDecoder()
 
     bibpath = system_path(bibpath)
     if os.path.isdir(bibpath):
@@ -43,19 +42,29 @@ def many_from_path(bibpath):
     else:
         all_files = [bibpath]
 
-    biblist = []
-    for filepath in all_files:
-        biblist.append(coder.decode_bibdata(read_file(filepath)))
+    if workers > 1:
+        coder = endecoder.DecodingPool(workers)
+    else:
+        coder = endecoder.EnDecoder()
 
-    papers = {}
-    for b in biblist:
-        for k, b in b.items():
-            try:
-                papers[k] = Paper(k, b)
-                papers[k].added = datetime.datetime.now()
-            except ValueError as e:
-                papers[k] = e
-    return papers
+    try:
+        for filepath in all_files:
+            with open_file(filepath, 'r') as f:
+                for k, b in coder.iter_bibdata(f):
+                    if isinstance(b, endecoder.MalformedEntry):
+                        if k is None:
+                            k = '{}:{}'.format(filepath, b.lineno)
+                        yield k, b
+                        continue
+                    try:
+                        p = Paper(k, b)
+                        p.added = datetime.datetime.now()
+                        yield k, p
+                    except ValueError as e:
+                        yield k, e
+    finally:
+        if workers > 1:
+            coder.close()
 
 
 def command(args):
@@ -71,22 +80,32 @@ def command(args):
         copy = config().import_copy
     rp = repo.Repository(config())
     # Extract papers from bib
-    papers = many_from_path(bibpath)
-    keys = args.keys or papers.keys()
-    for k in keys:
-        try:
-            p = papers[k]
-            if isinstance(p, Exception):
-                ui.error('could not load entry for citekey {}.'.format(k))
-            else:
-                rp.push_paper(p)
-                ui.message('{} imported'.format(color.dye_out(p.citekey, color.citekey)))
-                docfile = bibstruct.extract_docfile(p.bibdata)
-                if docfile is None:
-                    ui.warning("no file for {}.".format(p.citekey))
+    workers = int(config().decode_workers)
+    if args.keys:
+        papers = dict((k, p) for k, p in iter_from_path(bibpath, workers=workers)
+                      if k in args.keys)
+        entries = ((k, papers.get(k)) for k in args.keys)
+    else:
+        # entries are pushed as they are decoded
+        entries = iter_from_path(bibpath, workers=workers)
+    imported = set()
+    # the files are synced and the index saved once, at the end
+    with rp.batch():
+        for k, p in entries:
+            try:
+                if p is None:
+                    ui.error('no entry found for citekey {}.'.format(k))
+                elif isinstance(p, Exception):
+                    ui.error('could not load entry for citekey {} ({}).'.format(k, p))
                 else:
-                    rp.push_doc(p.citekey, docfile, copy=args.copy)
-        except KeyError:
-            ui.error('no entry found for citekey {}.'.format(k))
-        except IOError as e:
-            ui.error(e.message)
+                    # a duplicated entry overwrites the one imported before
+                    rp.push_paper(p, overwrite=p.citekey in imported)
+                    imported.add(p.citekey)
+                    ui.message('{} imported'.format(color.dye_out(p.citekey, color.citekey)))
+                    docfile = bibstruct.extract_docfile(p.bibdata)
+                    if docfile is None:
+                        ui.warning("no file for {}.".format(p.citekey))
+                    else:
+                        rp.push_doc(p.citekey, docfile, copy=args.copy)
+            except IOError as e:
+                ui.error(e.message)
@@ -1,3 +1,5 @@
+import re
+import heapq
 from datetime import datetime
 
 from .. import repo
@@ -26,9 +28,15 @@ def parser(subparsers):
     parser.add_argument('--no-docs', action='store_true',
             dest='nodocs', default=False,
             help='list only pubs without attached documents.')
+    parser.add_argument('-n', '--limit', type=int, default=None,
+            help='list only the first LIMIT papers, in the listing order.')
+    parser.add_argument('-r', '--reverse', action='store_true',
+            default=False, help='reverse the listing order.')
 
     parser.add_argument('query', nargs='*',
-            help='Paper query (e.g. "year: 2000" or "tags: math")')
+            help=('Paper query (e.g. "year: 2000" or "tags: math"). Queries '
+                  'can be combined with and, or, not and parentheses, and '
+                  'years given as ranges (e.g. "year:2000-2010").'))
     return parser
 
 
@@ -36,18 +44,44 @@ def date_added(p):
     return p.added or datetime(1, 1, 1)
 
 
+def sort_papers(papers, key, limit=None, reverse=False):
+    """ Sort the papers, keeping only the first limit ones if limit is
+        not None. The selection uses a heap of limit papers, the papers
+        are not all kept in memory.
+    """
+    if limit is None:
+        return sorted(papers, key=key, reverse=reverse)
+    if reverse:
+        return heapq.nlargest(limit, papers, key=key)
+    return heapq.nsmallest(limit, papers, key=key)
+
+
 def command(args):
     ui = get_ui()
     rp = repo.Repository(config())
-    papers = filter(lambda p: filter_paper(p, args.query,
-                                           case_sensitive=args.case_sensitive),
-                    rp.all_papers())
+    try:
+        cost, query, candidates = parse_query(args.query,
+                                              case_sensitive=args.case_sensitive)
+    except InvalidQuery as e:
+        ui.error(e)
+        ui.exit()
+    citekeys = None
+    if args.query:
+        citekeys = candidates(rp.index)
+        if citekeys is not None:
+            citekeys = sorted(citekeys)
+    # without query, the bibdata is only read for the papers displayed
+    lazy = not args.query and (args.citekeys or args.nodocs
+                               or args.limit is not None)
+    papers = filter(query, rp.pull_papers(citekeys, lazy=lazy))
     if args.nodocs:
-        papers = [p for p in papers if p.docpath is None]
+        papers = (p for p in papers if p.docpath is None)
     if args.alphabetical:
-        papers = sorted(papers, key=lambda p: p.citekey)
+        papers = sort_papers(papers, lambda p: p.citekey,
+                             limit=args.limit, reverse=args.reverse)
     else:
-        papers = sorted(papers, key=date_added)
+        papers = sort_papers(papers, date_added,
+                             limit=args.limit, reverse=args.reverse)
     if len(papers) > 0:
         ui.message('\n'.join(
             pretty.paper_oneliner(p, citekey_only=args.citekeys)
@@ -61,6 +95,18 @@ FIELD_ALIASES = {
     'tags': 'tag',
     }
 
+OPERATORS = {'and', 'or', 'not', '(', ')'}
+
+# Relative costs of the checks, cheaper checks are evaluated first.
+TAG_COST = 1
+FIELD_COST = 2
+AUTHOR_COST = 3
+
+YEAR_RANGE_RE = re.compile(r'^(\d*)-(\d*)$')
+
+# Fields whose candidates can be found in the index.
+INDEXED_FIELDS = {'author', 'title', 'tag', 'year', 'type'}
+
 
 def _get_field_value(query_block):
     split_block = query_block.split(':')
@@ -81,14 +127,14 @@ def _check_author_match(paper, query, case_sensitive=False):
     """Only checks within last names."""
     if not 'author' in paper.bibdata:
         return False
-    return any([query in _lower(bibstruct.author_last(p), lower=(not case_sensitive))
-                for p in paper.bibdata['author']])
+    return any(query in _lower(bibstruct.author_last(p), lower=(not case_sensitive))
+               for p in paper.bibdata['author'])
 
 
 
 def _check_tag_match(paper, query, case_sensitive=False):
-    return any([query in _lower(t, lower=(not case_sensitive))
-                for t in paper.tags])
+    return any(query in _lower(t, lower=(not case_sensitive))
+               for t in paper.tags)
 
 
 def _check_field_match(paper, field, query, case_sensitive=False):
@@ -96,22 +142,212 @@ def _check_field_match(paper, field, query, case_sensitive=False):
                            lower=(not case_sensitive))
 
 
-def _check_query_block(paper, query_block, case_sensitive=None):
+def _check_year_range(paper, first, last):
+    try:
+        year = int(paper.bibdata['year'])
+    except (KeyError, ValueError):
+        return False
+    return ((first is None or first <= year) and
+            (last is None or year <= last))
+
+
+def _no_candidates(index):
+    """Candidates of predicates that the index cannot narrow."""
+    return None
+
+
+def _compile_query_block(query_block, case_sensitive=None):
+    """ Return (cost, check, candidates) for a field:value query block.
+
+        candidates(index) returns a superset of the citekeys of the
+        matching papers, or None if the index cannot narrow them.
+    """
     field, value = _get_field_value(query_block)
+    year_range = YEAR_RANGE_RE.match(value) if field == 'year' else None
+    if year_range is not None and value != '-':
+        first, last = [int(y) if y else None for y in year_range.groups()]
+        return (FIELD_COST, lambda p: _check_year_range(p, first, last),
+                lambda index: index.search_years(first, last))
+    if field in INDEXED_FIELDS:
+        candidates = lambda index: index.search(field, value)
+    else:
+        candidates = _no_candidates
     if case_sensitive is None:
         case_sensitive = not value.islower()
     elif not case_sensitive:
             value = value.lower()
     if field == 'tag':
-        return _check_tag_match(paper, value, case_sensitive=case_sensitive)
+        return TAG_COST, lambda p: _check_tag_match(
+            p, value, case_sensitive=case_sensitive), candidates
     elif field == 'author':
-        return _check_author_match(paper, value, case_sensitive=case_sensitive)
-    elif field in paper.bibdata:
-        return _check_field_match(paper, field, value,
-                                  case_sensitive=case_sensitive)
+        return AUTHOR_COST, lambda p: _check_author_match(
+            p, value, case_sensitive=case_sensitive), candidates
     else:
+        return FIELD_COST, lambda p: (field in p.bibdata and _check_field_match(
+            p, field, value, case_sensitive=case_sensitive)), candidates
+
+
+def _check_query_block(paper, query_block, case_sensitive=None):
+    return _compile_query_block(query_block, case_sensitive=case_sensitive)[1](paper)
+
+
+def _all(predicates):
+    predicates = sorted(predicates, key=lambda predicate: predicate[0])
+    checks = [check for _, check, _ in predicates]
+
+    def check_all(paper):
+        for check in checks:
+            if not check(paper):
+                return False
+        return True
+
+    def candidates_all(index):
+        citekeys = None
+        for _, _, candidates in predicates:
+            found = candidates(index)
+            if found is None:
+                continue
+            citekeys = found if citekeys is None else citekeys & found
+            if not citekeys:
+                break
+        return citekeys
+    return sum(cost for cost, _, _ in predicates), check_all, candidates_all
+
+
+def _any(predicates):
+    predicates = sorted(predicates, key=lambda predicate: predicate[0])
+    checks = [check for _, check, _ in predicates]
+
+    def check_any(paper):
+        for check in checks:
+            if check(paper):
+                return True
         return False
 
+    def candidates_any(index):
+        citekeys = set()
+        for _, _, candidates in predicates:
+            found = candidates(index)
+            if found is None:
+                return None
+            citekeys |= found
+        return citekeys
+    return sum(cost for cost, _, _ in predicates), check_any, candidates_any
+
+
+def _tokenize(query):
+    """ Split parentheses from the query blocks and lower the operators.
+
+        Closing parentheses are only split while they are unbalanced, so
+        that values such as 'title:(draft)' or 'note:f(x)' are kept whole.
+    """
+    tokens = []
+    for block in query:
+        closing = []
+        while block.startswith('('):
+            tokens.append('(')
+            block = block[1:]
+        while block.endswith(')') and block.count(')') > block.count('('):
+            closing.append(')')
+            block = block[:-1]
+        if block:
+            tokens.append(block.lower() if block.lower() in OPERATORS else block)
+        tokens.extend(closing)
+    return tokens
+
+
+class _QueryParser(object):
+    """ Recursive descent parser for queries:
+
+        query  := term ('or' term)*
+        term   := factor (['and'] factor)*
+        factor := 'not' factor | '(' query ')' | field:value
+    """
+
+    def __init__(self, tokens, case_sensitive=None):
+        self.tokens = tokens
+        self.position = 0
+        self.case_sensitive = case_sensitive
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise InvalidQuery('Invalid query (unexpected end)')
+        self.position += 1
+        return token
+
+    def parse(self):
+        predicate = self.query()
+        if self.peek() is not None:
+            raise InvalidQuery('Invalid query (unexpected %s)' % self.peek())
+        return predicate
+
+    def query(self):
+        terms = [self.term()]
+        while self.peek() == 'or':
+            self.next()
+            terms.append(self.term())
+        return terms[0] if len(terms) == 1 else _any(terms)
+
+    def term(self):
+        factors = [self.factor()]
+        while self.peek() not in (None, 'or', ')'):
+            if self.peek() == 'and':
+                self.next()
+            factors.append(self.factor())
+        return factors[0] if len(factors) == 1 else _all(factors)
+
+    def factor(self):
+        token = self.next()
+        if token == 'not':
+            cost, check, _ = self.factor()
+            return cost, lambda p: not check(p), _no_candidates
+        elif token == '(':
+            predicate = self.query()
+            if self.next() != ')':
+                raise InvalidQuery('Invalid query (missing closing parenthesis)')
+            return predicate
+        elif token in OPERATORS:
+            raise InvalidQuery('Invalid query (unexpected %s)' % token)
+        else:
+            return _compile_query_block(token, case_sensitive=self.case_sensitive)
+
+
+def parse_query(query, case_sensitive=None):
+    """ Parse a query into (cost, check, candidates).
+
+        check is a predicate on papers. candidates(index) returns, from the
+        index of the repository, a superset of the citekeys of the papers
+        satisfying check, or None if all the papers must be checked.
+
+        :args query: list of query blocks and operators (strings)
+        :raise InvalidQuery: if the query cannot be parsed.
+    """
+    tokens = _tokenize(query)
+    if not tokens:
+        return 0, lambda p: True, _no_candidates
+    return _QueryParser(tokens, case_sensitive=case_sensitive).parse()
+
+
+def compile_query(query, case_sensitive=None):
+    """ Compile a query into a predicate on papers.
+
+        The query blocks (field:value) are combined with 'and' (implicit
+        between consecutive blocks), 'or', 'not' and parentheses. Years
+        can be given as ranges, e.g. 'year:2000-2010', 'year:2000-'.
+        If case_sensitive is not given, a block is only case sensitive if
+        its value is not lowercase.
+
+        :args query: list of query blocks and operators (strings)
+        :raise InvalidQuery: if the query cannot be parsed.
+    """
+    return parse_query(query, case_sensitive=case_sensitive)[1]
+
 
 # TODO implement search by type of document
 def filter_paper(paper, query, case_sensitive=None):
@@ -120,6 +356,4 @@ def filter_paper(paper, query, case_sensitive=None):
 
     :args query: list of query blocks (strings)
     """
-    return all([_check_query_block(paper, query_block,
-                                   case_sensitive=case_sensitive)
-                for query_block in query])
+    return compile_query(query, case_sensitive=case_sensitive)(paper)
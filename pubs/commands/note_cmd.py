@@ -19,7 +19,7 @@ def command(args):
 
 
     rp = repo.Repository(config())
-    if not rp.databroker.exists(args.citekey):
+    if args.citekey not in rp:
         ui.error("citekey {} not found".format(args.citekey))
         ui.exit(1)
 
@@ -24,7 +24,7 @@ def command(args):
 
     rp = repo.Repository(config())
     citekey = resolve_citekey(rp, args.citekey, ui=ui, exit_on_fail=True)
-    paper = rp.pull_paper(citekey)
+    paper = rp.pull_paper(citekey, lazy=True)
 
     if with_command is None:
         with_command = config().open_cmd
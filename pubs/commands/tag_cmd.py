@@ -83,8 +83,8 @@ def command(args):
     if citekeyOrTag is None:
         ui.message(color.dye_out(' '.join(sorted(rp.get_tags())), color.tag))
     else:
-        if rp.databroker.exists(citekeyOrTag):
-            p = rp.pull_paper(citekeyOrTag)
+        if citekeyOrTag in rp:
+            p = rp.pull_paper(citekeyOrTag, lazy=True)
             if tags is None:
                 ui.message(color.dye_out(' '.join(sorted(p.tags)), color.tag))
             else:
@@ -100,11 +100,7 @@ def command(args):
         else:
             # case where we want to find papers with specific tags
             included, excluded = _tag_groups(_parse_tag_seq(citekeyOrTag))
-            papers_list = []
-            for p in rp.all_papers():
-                if (p.tags.issuperset(included) and
-                    len(p.tags.intersection(excluded)) == 0):
-                    papers_list.append(p)
+            papers_list = rp.tagged_papers(included, excluded)
 
             ui.message('\n'.join(pretty.paper_oneliner(p)
                                  for p in papers_list))
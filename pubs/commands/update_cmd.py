@@ -1,37 +1,77 @@
 import sys
 
-from .. import repo
 from .. import color
-from ..configs import config
+from ..configs import config, normalize_version
 from ..uis import get_ui
+from ..filebroker import FileBroker, FLAT_FORMAT, SHARDED_FORMAT
+from ..sqlitebroker import SQLiteBroker
+from ..databroker import copy_files
 from ..__init__ import __version__
 
+
+LAYOUTS = {'flat': FLAT_FORMAT, 'sharded': SHARDED_FORMAT}
+STORAGES = ('files', 'sqlite')
+
+
 def parser(subparsers):
     parser = subparsers.add_parser('update', help='update the repository to the lastest format')
+    parser.add_argument('--layout', choices=sorted(LAYOUTS), default=None,
+                        help=('convert the bib and meta files to the given layout '
+                              '(sharded is faster for very large repositories)'))
+    parser.add_argument('--storage', choices=STORAGES, default=None,
+                        help=('move the bib and meta files to the given storage '
+                              '(sqlite stores them in a single database)'))
     return parser
 
 
+def _broker(storage, sharded, create=False):
+    if storage == 'sqlite':
+        return SQLiteBroker(config().pubsdir, create=create)
+    return FileBroker(config().pubsdir, create=create, sharded=sharded)
+
+
 def command(args):
 
     ui = get_ui()
 
-    code_version = __version__
-    repo_version = int(config().version)
+    normalize_version(config())
+    code_version = __version__.split('.')
+    repo_version = config().version.split('.')
+    repo_format = int(config().repo_format)
+    target_format = repo_format if args.layout is None else LAYOUTS[args.layout]
+    storage = config().storage
+    target_storage = storage if args.storage is None else args.storage
 
-    if repo_version == code_version:
-        ui.message('Your pubs repository is up-to-date.')
-        sys.exit(0)
-    elif repo_version > code_version:
+    if repo_version > code_version:
         ui.message('Your repository was generated with an newer version of pubs.\n'
-                     'You should not use pubs until you install the newest version.')
+                   'You should not use pubs until you install the newest version.')
+        sys.exit(0)
+    elif (repo_version == code_version and repo_format == target_format
+          and storage == target_storage):
+        ui.message('Your pubs repository is up-to-date.')
         sys.exit(0)
     else:
-        msg = ("You should backup the pubs directory {} before continuing."
-               "Continue ?").format(color.dye_out(config().papers_dir, color.filepath))
+        msg = ("You should backup the pubs directory {} before continuing. "
+               "Continue ?").format(color.dye_out(config().pubsdir, color.filepath))
         sure = ui.input_yn(question=msg, default='n')
         if not sure:
             sys.exit(0)
 
+    sharded = repo_format == SHARDED_FORMAT
+    if storage != target_storage:
+        source = _broker(storage, sharded)
+        target = _broker(target_storage, sharded, create=True)
+        for citekey in copy_files(source, target):
+            source.remove(citekey)
+        config().storage = target_storage
+        ui.message('The repository now uses the {} storage.'.format(target_storage))
+
+    if repo_format != target_format:
+        if target_storage == 'files':
+            filebroker = FileBroker(config().pubsdir, sharded=sharded)
+            filebroker.convert_layout(sharded=(target_format == SHARDED_FORMAT))
+        config().repo_format = target_format
+        ui.message('The repository now uses the {} layout.'.format(args.layout))
 
-#        config().version = repo_version
-#        config().save()
+    config().version = __version__
+    config().save()
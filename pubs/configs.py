@@ -4,7 +4,7 @@ import collections
 
 from .p3 import configparser, ConfigParser, _read_config
 
-from .content import check_file, _open
+from .content import check_file, open_file
 from . import __version__
 
 # constant stuff (DFT = DEFAULT)
@@ -25,6 +25,10 @@ DFT_CONFIG = collections.OrderedDict([
               ('import_move',     False),
               ('color',           True),
               ('version',         __version__),
+              ('repo_format',     1),
+              ('storage',         'files'),
+              ('decode_workers',  0),
+              ('metadata_format', 'yaml'),
               ('version_warning', True),
               ('open_cmd',       'open'),
               ('edit_cmd',        DFT_EDIT_CMD),
@@ -46,6 +50,12 @@ def config(section=MAIN_SECTION):
     return _config
 
 
+def normalize_version(config):
+    """Convert the deprecated single number version scheme ('3' -> '0.3.0')."""
+    if len(config.version) == 1:
+        config.version = '0.{}.0'.format(config.version)
+
+
 class Config(object):
 
     def __init__(self, **kwargs):
@@ -70,7 +80,7 @@ class Config(object):
         b_flag = ''
         if sys.version_info[0] == 2: # HACK, FIXME please
             b_flag = 'b'
-        with _open(path, 'r{}+'.format(b_flag)) as f:
+        with open_file(path, 'r{}+'.format(b_flag)) as f:
             _read_config(self._cfg, f)
         return self
 
@@ -78,7 +88,7 @@ class Config(object):
         b_flag = ''
         if sys.version_info[0] == 2: # HACK, FIXME please
             b_flag = 'b'
-        with _open(path, 'w{}+'.format(b_flag)) as f:
+        with open_file(path, 'w{}+'.format(b_flag)) as f:
             self._cfg.write(f)
 
     def __setattr__(self, name, value):
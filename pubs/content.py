@@ -1,5 +1,6 @@
 import os
 import io
+import stat
 import subprocess
 import tempfile
 import shutil
@@ -37,11 +38,12 @@ def system_path(path):
     return os.path.abspath(os.path.expanduser(path))
 
 
-def _open(path, mode):
-        if mode.find('b') == -1:
-            return io.open(system_path(path), mode, encoding='utf-8')
-        else:
-            return io.open(system_path(path), mode)
+def open_file(path, mode):
+    """Open a file, as utf-8 text unless mode is binary."""
+    if mode.find('b') == -1:
+        return io.open(system_path(path), mode, encoding='utf-8')
+    else:
+        return io.open(system_path(path), mode)
 
 
 def check_file(path, fail=True):
@@ -56,22 +58,160 @@ def check_directory(path, fail=True):
             and _check_system_path_is(u'isdir', syspath, fail=fail))
 
 
-def read_file(filepath):
-    check_file(filepath)
-    with _open(filepath, 'r') as f:
+def file_stats(path):
+    """Return the stats of a file, using a single system call.
+
+    :raise IOError: if path does not exist or is not a file.
+    """
+    syspath = system_path(path)
+    try:
+        stats = os.stat(syspath)
+    except OSError:
+        raise IOError(u'File does not exist: {}'.format(syspath))
+    if not stat.S_ISREG(stats.st_mode):
+        raise IOError(u'{} is not a isfile.'.format(syspath))
+    return stats
+
+
+def is_file(path):
+    """Return True if path is an existing file, using a single system call."""
+    try:
+        return stat.S_ISREG(os.stat(system_path(path)).st_mode)
+    except OSError:
+        return False
+
+
+class _DirEntry(object):
+    """Minimal replacement for os.DirEntry, when os.scandir is missing."""
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._stats = None
+
+    def stat(self):
+        if self._stats is None:
+            self._stats = os.stat(self.path)
+        return self._stats
+
+    def is_file(self):
+        return stat.S_ISREG(self.stat().st_mode)
+
+    def is_dir(self):
+        return stat.S_ISDIR(self.stat().st_mode)
+
+
+def scandir(path):
+    """Iterate over the entries of a directory, as os.scandir does.
+
+    Falls back on os.listdir when os.scandir is not available (python 2).
+    """
+    syspath = system_path(path)
+    try:
+        os_scandir = os.scandir
+    except AttributeError:
+        return [_DirEntry(syspath, name) for name in os.listdir(syspath)]
+    return os_scandir(syspath)
+
+
+def read_file(filepath, check=True):
+    """Read a text file.
+
+    :param check: if False, skips the existence check; missing files still
+                  raise IOError when opened.
+    """
+    if check:
+        check_file(filepath)
+    with open_file(filepath, 'r') as f:
         content = f.read()
     return content
 
 
+def read_byte_file(filepath):
+    check_file(filepath)
+    with open_file(filepath, 'rb') as f:
+        byte_content = f.read()
+    return byte_content
+
+
 def remove_file(filepath):
     check_file(filepath)
     os.remove(filepath)
 
 
-def write_file(filepath, data):
-    check_directory(os.path.dirname(filepath))
-    with _open(filepath, 'w') as f:
-        f.write(data)
+def _replace(source, target):
+    try:
+        os_replace = os.replace
+    except AttributeError:  # python 2, rename replaces files on posix
+        os_replace = os.rename
+    os_replace(source, target)
+
+
+def _write_atomic(filepath, data, mode, sync, check):
+    if check:
+        check_directory(os.path.dirname(filepath))
+    syspath = system_path(filepath)
+    tmppath = u'{}.{}.tmp'.format(syspath, os.getpid())
+    try:
+        with open_file(tmppath, mode) as f:
+            f.write(data)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        _replace(tmppath, syspath)
+    except BaseException:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+
+
+def write_file(filepath, data, sync=True, check=True):
+    """Write a text file atomically.
+
+    The data is written to a temporary file in the same directory, which
+    is then renamed over filepath. With sync, the data is flushed to disk
+    before the rename: after a crash, the file holds either its old or its
+    new content, never a truncated one.
+
+    :param sync:  if False, the data is not flushed to disk before the
+                  rename (relaxed durability): until sync_files is called
+                  on the written files, a crash may leave the file empty
+                  or truncated. Bulk writers call it once on all of them.
+    :param check: if False, skips the check of the directory.
+    """
+    _write_atomic(filepath, data, 'w', sync, check)
+
+
+def write_byte_file(filepath, byte_data, sync=True, check=True):
+    """Write a binary file atomically, see write_file."""
+    _write_atomic(filepath, byte_data, 'wb', sync, check)
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_files(filepaths):
+    """Flush files, and once each the directories holding them, to disk.
+
+    Missing files (e.g. removed ones) only have their directory synced.
+    Directories that cannot be opened (e.g. on Windows) are skipped.
+    """
+    directories = set()
+    for filepath in filepaths:
+        syspath = system_path(filepath)
+        directories.add(os.path.dirname(syspath))
+        if os.path.exists(syspath):
+            _fsync_path(syspath)
+    for directory in sorted(directories):
+        try:
+            _fsync_path(directory)
+        except OSError:
+            pass
 
 
 # dealing with formatless content
@@ -111,7 +251,7 @@ def _dump_byte_url_content(source, target):
     """Caution: this method does not test for existing destination.
     """
     byte_content = _get_byte_url_content(source)
-    with _open(target, 'wb') as f:
+    with open_file(target, 'wb') as f:
         f.write(byte_content)
 
 
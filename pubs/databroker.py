@@ -1,19 +1,81 @@
+import contextlib
+
 from . import filebroker
+from . import sqlitebroker
 from . import endecoder
 
 
+BATCH_SIZE = 200
+DECODE_CACHE_SIZE = 128
+
+
+def copy_files(source, target):
+    """ Copy all the meta and bib files of a FileBroker or SQLiteBroker
+        into another one.
+
+        :returns: the set of copied citekeys.
+    """
+    listing = source.listing(filestats=False)
+    with target.batch():
+        for citekey in listing['metafiles']:
+            target.push_metafile(citekey, source.pull_metafile(citekey))
+        for citekey in listing['bibfiles']:
+            target.push_bibfile(citekey, source.pull_bibfile(citekey))
+    return set(listing['metafiles']).union(listing['bibfiles'])
+
+
 class DataBroker(object):
     """ DataBroker class
 
         This is aimed at being a simple, high level interface to the content stored on disk.
         Requests are optimistically made, and exceptions are raised if something goes wrong.
+
+        :param storage:  'files' to store bib and meta files in directories
+                         (FileBroker), 'sqlite' to store them in a single
+                         database (SQLiteBroker).
+        :param workers:  if more than 1, bulk pulls decode the files in a
+                         pool of that many worker processes.
+        :param metadata_format:  'yaml' or 'json', the format metadata is
+                                 written in. Both are read.
     """
 
-    def __init__(self, directory, create=False):
-        self.filebroker = filebroker.FileBroker(directory, create=create)
-        self.endecoder  = endecoder.EnDecoder()
+    def __init__(self, directory, create=False, sharded=False, storage='files',
+                 workers=0, metadata_format='yaml'):
+        if storage == 'files':
+            self.filebroker = filebroker.FileBroker(directory, create=create,
+                                                    sharded=sharded)
+        elif storage == 'sqlite':
+            self.filebroker = sqlitebroker.SQLiteBroker(directory, create=create)
+        else:
+            raise ValueError('unknown storage: {}'.format(storage))
+        self.endecoder  = endecoder.EnDecoder(metadata_format=metadata_format,
+                                              cache_size=DECODE_CACHE_SIZE)
         self.docbroker  = filebroker.DocBroker(directory, scheme='docsdir', subdir='doc')
         self.notebroker = filebroker.DocBroker(directory, scheme='notesdir', subdir='notes')
+        self.workers = workers
+        self._pool = None
+
+    @property
+    def batch_size(self):
+        """Number of papers pulled at once by pull_many."""
+        return BATCH_SIZE * max(1, self.workers)
+
+    @contextlib.contextmanager
+    def decoding_pool(self):
+        """Decode the bulk pulls of the block in a pool of worker processes."""
+        if self.workers <= 1 or self._pool is not None:
+            yield
+            return
+        self._pool = endecoder.DecodingPool(self.workers)
+        try:
+            yield
+        finally:
+            self._pool.close()
+            self._pool = None
+
+    @property
+    def _bulk_decoder(self):
+        return self._pool or self.endecoder
 
     # filebroker+endecoder
 
@@ -25,6 +87,46 @@ class DataBroker(object):
         bibdata_raw = self.filebroker.pull_bibfile(citekey)
         return self.endecoder.decode_bibdata(bibdata_raw)
 
+    def pull_many_metadata(self, citekeys):
+        metadata_raws = self.filebroker.pull_metafiles(citekeys)
+        return self._bulk_decoder.decode_many_metadata(metadata_raws)
+
+    def pull_many_bibentries(self, citekeys):
+        bibdata_raws = self.filebroker.pull_bibfiles(citekeys)
+        return self._bulk_decoder.decode_many_bibdata(bibdata_raws)
+
+    def pull_many(self, citekeys=None):
+        """ Yields (citekey, bibentry, metadata) for several citekeys,
+            reading and decoding the files by batches.
+
+            :param citekeys:  if None, all the papers of the repository.
+        """
+        if citekeys is None:
+            citekeys = self.filebroker.citekeys()
+        citekeys = list(citekeys)
+        batch_size = self.batch_size
+        with self.decoding_pool():
+            for start in range(0, len(citekeys), batch_size):
+                batch = citekeys[start:start + batch_size]
+                for item in zip(batch, self.pull_many_bibentries(batch),
+                                self.pull_many_metadata(batch)):
+                    yield item
+
+    def stat_metafile(self, citekey):
+        return self.filebroker.stat_metafile(citekey)
+
+    def stat_bibfile(self, citekey):
+        return self.filebroker.stat_bibfile(citekey)
+
+    def batch(self):
+        """Group the writes of the block, see FileBroker and SQLiteBroker."""
+        return self.filebroker.batch()
+
+    @property
+    def transactional(self):
+        """True if the writes of a failed batch are rolled back."""
+        return self.filebroker.transactional
+
     def push_metadata(self, citekey, metadata):
         metadata_raw = self.endecoder.encode_metadata(metadata)
         self.filebroker.push_metafile(citekey, metadata_raw)
@@ -47,12 +149,14 @@ class DataBroker(object):
         return self.filebroker.exists(citekey, meta_check=meta_check)
 
     def citekeys(self):
-        listings = self.listing(filestats=False)
-        return set(listings['bibfiles'])
+        return set(self.filebroker.citekeys())
 
     def listing(self, filestats=True):
         return self.filebroker.listing(filestats=filestats)
 
+    def citekeys_stamp(self):
+        return self.filebroker.citekeys_stamp()
+
     def verify(self, bibdata_raw):
         """Will return None if bibdata_raw can't be decoded"""
         try:
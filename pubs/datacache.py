@@ -1,5 +1,37 @@
 
+import os
+import time
+import pickle
+
 from . import databroker
+from .content import check_file, read_byte_file, write_byte_file
+
+
+SNAPSHOT_FILE = '.cache'
+SNAPSHOT_VERSION = 2
+PICKLE_PROTOCOL = 2  # readable by python 2 and 3
+
+# Files modified less than RACY_DELAY seconds before being read are not
+# cached: another modification in the same timestamp tick would go unnoticed.
+RACY_DELAY = 1.0
+
+
+def _stamp(stats):
+    """Summary of a file stats used to detect modifications."""
+    return (stats.st_mtime, stats.st_ctime, stats.st_size, stats.st_ino)
+
+
+def _listing_stats(citekeys, stats):
+    """Return a stat function serving the stats of a listing."""
+    stats = dict(zip(citekeys, stats))
+
+    def stat_fun(citekey):
+        try:
+            return stats[citekey]
+        except KeyError:
+            raise IOError(u'File does not exist for citekey: {}'.format(citekey))
+    return stat_fun
+
 
 class DataCache(object):
     """ DataCache class, provides a very similar interface as DataBroker
@@ -11,39 +43,211 @@ class DataCache(object):
            when they are a lot of files. Update are also done only when required.
            Changes are detected using data modification timestamps.
 
-        For the moment, only (1) is implemented.
+        The snapshot stores, for each bib and meta file, its stats and the
+        pickled decoded content. A file is only decoded again when its stats
+        changed. The snapshot is written back to disk by save_snapshot().
+        It is only loaded by bulk pulls: single pulls read the files
+        directly, unless the snapshot is already loaded.
     """
-    def __init__(self, directory, create=False):
+    def __init__(self, directory, create=False, sharded=False, storage='files',
+                 workers=0, metadata_format='yaml'):
         self.directory = directory
+        self.sharded = sharded
+        self.storage = storage
+        self.workers = workers
+        self.metadata_format = metadata_format
         self._databroker = None
+        self._snapshot = None
+        self._snapshot_modified = False
         if create:
             self._create()
 
     @property
     def databroker(self):
         if self._databroker is None:
-            self._databroker = databroker.DataBroker(self.directory, create=False)
+            self._databroker = databroker.DataBroker(self.directory, create=False,
+                                                     sharded=self.sharded,
+                                                     storage=self.storage,
+                                                     workers=self.workers,
+                                                     metadata_format=self.metadata_format)
         return self._databroker
 
+    @property
+    def endecoder(self):
+        """The encoder of the repository, with its cache of decoded content."""
+        return self.databroker.endecoder
+
     def _create(self):
-        self._databroker = databroker.DataBroker(self.directory, create=True)
+        self._databroker = databroker.DataBroker(self.directory, create=True,
+                                                 sharded=self.sharded,
+                                                 storage=self.storage,
+                                                 workers=self.workers,
+                                                 metadata_format=self.metadata_format)
+
+    # snapshot
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.directory, SNAPSHOT_FILE)
+
+    @property
+    def snapshot(self):
+        if self._snapshot is None:
+            self._snapshot = self._load_snapshot()
+        return self._snapshot
+
+    def _empty_snapshot(self):
+        return {'version': SNAPSHOT_VERSION, 'bib': {}, 'meta': {}}
+
+    def _load_snapshot(self):
+        if check_file(self.snapshot_path, fail=False):
+            try:
+                snapshot = pickle.loads(read_byte_file(self.snapshot_path))
+                if snapshot.get('version') == SNAPSHOT_VERSION:
+                    return snapshot
+            except Exception:  # corrupted snapshot, it is rebuilt
+                pass
+        return self._empty_snapshot()
+
+    def save_snapshot(self):
+        """Write the snapshot to disk, if it changed since it was loaded."""
+        if self._snapshot_modified:
+            # a lost snapshot is rebuilt, it does not need to be synced
+            write_byte_file(self.snapshot_path,
+                            pickle.dumps(self._snapshot, PICKLE_PROTOCOL),
+                            sync=False)
+            self._snapshot_modified = False
+
+    def _prune(self, listing):
+        """Discard the snapshot entries of the files missing from listing."""
+        for kind in ('bib', 'meta'):
+            entries = self.snapshot[kind]
+            for citekey in set(entries).difference(listing[kind + 'files']):
+                del entries[citekey]
+                self._snapshot_modified = True
+
+    def _invalidate(self, citekey):
+        if self._snapshot is None:  # stale entries are detected when loaded
+            return
+        for kind in ('bib', 'meta'):
+            if citekey in self._snapshot[kind]:
+                del self._snapshot[kind][citekey]
+                self._snapshot_modified = True
+
+    def _pull_cached(self, kind, citekeys, stat_fun, pull_many_fun):
+        """ Return the decoded data of citekeys, from the snapshot when the
+            stats of the file did not change, using pull_many_fun otherwise.
+        """
+        now = time.time()
+        entries = self.snapshot[kind]
+        stamps = [_stamp(stat_fun(citekey)) for citekey in citekeys]
+        results = [None] * len(citekeys)
+        missing = []
+        for i, (citekey, stamp) in enumerate(zip(citekeys, stamps)):
+            cached = entries.get(citekey)
+            if cached is not None and cached[0] == stamp:
+                results[i] = pickle.loads(cached[1])
+            else:
+                missing.append(i)
+        if not missing:
+            return results
+
+        pulled = pull_many_fun([citekeys[i] for i in missing])
+        for i, data in zip(missing, pulled):
+            citekey, stamp = citekeys[i], stamps[i]
+            if max(stamp[0], stamp[1]) < now - RACY_DELAY:
+                entries[citekey] = (stamp, pickle.dumps(data, PICKLE_PROTOCOL))
+                self._snapshot_modified = True
+            elif citekey in entries:
+                del entries[citekey]
+                self._snapshot_modified = True
+            results[i] = data
+        return results
+
+    # databroker
 
     def pull_metadata(self, citekey):
-        return self.databroker.pull_metadata(citekey)
+        if self._snapshot is None:
+            return self.databroker.pull_metadata(citekey)
+        return self._pull_cached('meta', [citekey],
+                                 self.databroker.stat_metafile,
+                                 self.databroker.pull_many_metadata)[0]
 
     def pull_bibentry(self, citekey):
-        return self.databroker.pull_bibentry(citekey)
+        if self._snapshot is None:
+            return self.databroker.pull_bibentry(citekey)
+        return self._pull_cached('bib', [citekey],
+                                 self.databroker.stat_bibfile,
+                                 self.databroker.pull_many_bibentries)[0]
+
+    def _stat_funs(self, citekeys):
+        """ Return (citekeys, stat_bibfile, stat_metafile). When citekeys is
+            None, all the citekeys are returned, the stats come from a
+            single listing and the entries of removed files are pruned.
+        """
+        if citekeys is None:
+            listing = self.databroker.listing(filestats=True)
+            self._prune(listing)
+            return (listing['bibfiles'],
+                    _listing_stats(listing['bibfiles'], listing['bibstats']),
+                    _listing_stats(listing['metafiles'], listing['metastats']))
+        return (list(citekeys), self.databroker.stat_bibfile,
+                self.databroker.stat_metafile)
+
+    def pull_many(self, citekeys=None):
+        """ Yields (citekey, bibentry, metadata) for several citekeys.
+
+            Files are only read and decoded, by batches, when they are not
+            up-to-date in the snapshot. When citekeys is None, all the papers
+            are pulled and the stats come from a single listing.
+        """
+        citekeys, stat_bibfile, stat_metafile = self._stat_funs(citekeys)
+        batch_size = self.databroker.batch_size
+        with self.databroker.decoding_pool():
+            for start in range(0, len(citekeys), batch_size):
+                batch = citekeys[start:start + batch_size]
+                bibentries = self._pull_cached('bib', batch, stat_bibfile,
+                                               self.databroker.pull_many_bibentries)
+                metadata = self._pull_cached('meta', batch, stat_metafile,
+                                             self.databroker.pull_many_metadata)
+                for item in zip(batch, bibentries, metadata):
+                    yield item
+
+    def pull_many_metadata(self, citekeys=None):
+        """ Yields (citekey, metadata) for several citekeys, as pull_many
+            but without reading the bibfiles.
+        """
+        citekeys, _, stat_metafile = self._stat_funs(citekeys)
+        batch_size = self.databroker.batch_size
+        with self.databroker.decoding_pool():
+            for start in range(0, len(citekeys), batch_size):
+                batch = citekeys[start:start + batch_size]
+                metadata = self._pull_cached('meta', batch, stat_metafile,
+                                             self.databroker.pull_many_metadata)
+                for item in zip(batch, metadata):
+                    yield item
+
+    def batch(self):
+        return self.databroker.batch()
+
+    @property
+    def transactional(self):
+        return self.databroker.transactional
 
     def push_metadata(self, citekey, metadata):
+        self._invalidate(citekey)
         self.databroker.push_metadata(citekey, metadata)
 
     def push_bibentry(self, citekey, bibdata):
+        self._invalidate(citekey)
         self.databroker.push_bibentry(citekey, bibdata)
 
     def push(self, citekey, metadata, bibdata):
+        self._invalidate(citekey)
         self.databroker.push(citekey, metadata, bibdata)
 
     def remove(self, citekey):
+        self._invalidate(citekey)
         self.databroker.remove(citekey)
 
     def exists(self, citekey, meta_check=False):
@@ -55,6 +259,9 @@ class DataCache(object):
     def listing(self, filestats=True):
         return self.databroker.listing(filestats=filestats)
 
+    def citekeys_stamp(self):
+        return self.databroker.citekeys_stamp()
+
     def verify(self, bibdata_raw):
         return self.databroker.verify(bibdata_raw)
 
@@ -87,12 +294,49 @@ class DataCache(object):
         return self.databroker.rename_note(old_citekey, new_citekey)
 
 
-# class ChangeTracker(object):
+class ChangeTracker(object):
+    """ Detects the papers whose files changed since the manifest was saved.
+
+        The manifest maps each citekey with a bibfile to the stamps of its
+        bib and meta files (None for a missing metafile). It is compared to
+        a single listing of the bib and meta directories.
+    """
+
+    def __init__(self, databroker, manifest=None):
+        self.databroker = databroker
+        self.manifest = manifest if manifest is not None else {}
+
+    def scan(self):
+        """ Return the manifest of the files currently on disk.
+
+            Files modified less than RACY_DELAY seconds ago get a None
+            stamp, so that they are reported again on the next scan.
+        """
+        now = time.time()
+        listing = self.databroker.listing(filestats=True)
+
+        def stamp(stats):
+            if max(stats.st_mtime, stats.st_ctime) < now - RACY_DELAY:
+                return _stamp(stats)
 
-#     def __init__(self, cache, directory):
-#         self.cache = cache
-#         self.directory = directory
+        metastamps = dict(zip(listing['metafiles'],
+                              map(stamp, listing['metastats'])))
+        return dict((citekey, (stamp(stats), metastamps.get(citekey)))
+                    for citekey, stats in zip(listing['bibfiles'],
+                                              listing['bibstats']))
 
-#     def changes(self):
-#         """ Returns the list of modified files since the last cache was saved to disk"""
-#         pass
+    def changes(self):
+        """ Returns the sets of added, modified and removed citekeys since
+            the manifest was saved, and replace the manifest by the current one.
+        """
+        current = self.scan()
+        added, modified = set(), set()
+        for citekey, stamps in current.items():
+            old_stamps = self.manifest.get(citekey)
+            if old_stamps is None:
+                added.add(citekey)
+            elif None in stamps or stamps != old_stamps:
+                modified.add(citekey)
+        removed = set(self.manifest).difference(current)
+        self.manifest = current
+        return added, modified, removed
@@ -1,7 +1,14 @@
 from __future__ import (print_function, absolute_import, division,
                         unicode_literals)
 
-import copy
+import re
+import json
+import pickle
+import hashlib
+import datetime
+import itertools
+import collections
+import multiprocessing
 
 try:
     import bibtexparser as bp
@@ -11,8 +18,13 @@ except ImportError:
     exit(-1)
 
 import yaml
+try:  # the libyaml bindings are much faster, when available
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
 
 from .bibstruct import TYPE_KEY
+from .paper import parse_added
 
 """Important notice:
     All functions and methods in this file assume and produce unicode data.
@@ -52,9 +64,169 @@ def customizations(record):
 
     return record
 
+
+# Entry types kept by bibtexparser (it ignores non-standard types).
+STANDARD_TYPES = frozenset(['article', 'book', 'booklet', 'conference',
+                            'inbook', 'incollection', 'inproceedings',
+                            'manual', 'mastersthesis', 'misc', 'phdthesis',
+                            'proceedings', 'techreport', 'unpublished'])
+# Field names homogenised by bibtexparser (e.g. url -> link).
+_ALT_KEYS = bp.bparser.BibTexParser().alt_dict
+
+_CANONICAL_HEAD_RE = re.compile(r'@(\w+)\{([^\s,{}]+),$', re.UNICODE)
+_CANONICAL_FIELD_RE = re.compile(r'([^\s=,{}"#@]+) = (\{.*\}),$', re.UNICODE)
+
+
+def _strip_braces(value):
+    """Strip the braces enclosing value, as bibtexparser does."""
+    value = value.strip()
+    if value.startswith('{') and value.endswith('}'):
+        inner = value[1:-1]
+        if '{' not in inner and '}' not in inner:
+            return inner
+        depth = 0
+        for i, c in enumerate(value):
+            if c == '{':
+                depth += 1
+            elif c == '}':
+                depth -= 1
+            if depth == 0:
+                break
+        if i == len(value) - 1:
+            return value[1:-1]
+    return value
+
+
+def _canonical_value(value):
+    """Return the value bibtexparser reads from a braced field value."""
+    if value == '{}':
+        return ''
+    value = _strip_braces(value).strip()
+    if value.startswith('"') and value.endswith('"'):
+        value = value[1:-1]
+    return _strip_braces(value)
+
+
+def _read_canonical_entry(bibdata_raw):
+    """ Read a bibtex entry in the format written by EnDecoder.
+
+        The entry must be alone, start with an `@type{citekey,` line and
+        hold one `key = {value},` field per line, closed by a `}` line.
+        :returns: the record, as produced by bibtexparser with the pubs
+            customizations, or None if bibdata_raw deviates from the format.
+    """
+    if '\r' in bibdata_raw or '#' in bibdata_raw:
+        return None
+    lines = bibdata_raw.strip().split('\n')
+    if len(lines) < 3 or lines[-1].strip() != '}':
+        return None
+    m = _CANONICAL_HEAD_RE.match(lines[0].strip())
+    if m is None:
+        return None
+    bibtype, citekey = m.group(1).lower(), m.group(2)
+    if bibtype not in STANDARD_TYPES:
+        return None
+    record = {}
+    for line in lines[1:-1]:
+        m = _CANONICAL_FIELD_RE.match(line.strip())
+        if m is None:
+            return None
+        key, value = m.group(1).lower(), m.group(2)
+        if value.count('{') != value.count('}'):
+            return None
+        record[_ALT_KEYS.get(key, key)] = _canonical_value(value)
+    record[BP_ENTRYTYPE_KEY] = bibtype
+    record[BP_ID_KEY] = citekey
+    return customizations(record)
+
+
+class MalformedEntry(ValueError):
+    """A bibtex entry that could not be decoded, starting at line lineno."""
+
+    def __init__(self, message, lineno):
+        super(MalformedEntry, self).__init__(message)
+        self.lineno = lineno
+
+
+_ENTRY_HEAD_RE = re.compile(r'@\w+\s*\{\s*([^\s,{}]+)\s*,', re.UNICODE)
+
+
+def _string_parser(strings):
+    """A bibtexparser parser with the @string macros already defined."""
+    parser = bp.bparser.BibTexParser()
+    parser.customization = customizations
+    parser.bib_database.strings = strings
+    return parser
+
+
+_MACRO_NAME_RE = re.compile(r'[^\s"#{},=]+', re.UNICODE)
+
+
+def _iter_records(lines):
+    """ Split bibtex lines into records, as bibtexparser does (a record
+        starts on a line beginning with '@').
+
+        @comment and @preamble records are skipped, @string records are
+        parsed once, as they are read, into the macros the records that
+        follow them may refer to.
+        :returns: generator of (lineno, strings, record), strings being
+            the dictionary of macros defined before the record.
+    """
+    strings, shared = {}, False
+    record, start = [], 0
+    # the final '@' flushes the last record
+    for lineno, line in enumerate(itertools.chain(lines, ['@']), 1):
+        if line.strip().startswith('@'):
+            if record:
+                text = ''.join(record)
+                kind = text[1:].lower()
+                if kind.startswith('string'):
+                    if shared:  # records already yielded keep their macros
+                        strings, shared = dict(strings), False
+                    try:
+                        _string_parser(strings).parse(text)
+                    except Exception:
+                        pass  # malformed definitions are ignored
+                elif not kind.startswith(('comment', 'preamble')):
+                    shared = True
+                    yield start, strings, text
+            record, start = [line.lstrip()], lineno
+        elif record:
+            record.append(line)
+
+
+def _count_records(bibdata_raw):
+    """Count the records, as delimited by bibtexparser (lines starting with '@')."""
+    count = 0
+    for line in bibdata_raw.splitlines():
+        line = line.lstrip()
+        if line.startswith('@'):
+            if line[1:].lower().startswith(('comment', 'preamble', 'string')):
+                return -1
+            count += 1
+    return count
+
+
+METADATA_FORMATS = ('yaml', 'json')
+
+
+def _json_default(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    elif isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def _is_json(metadata_raw):
+    return metadata_raw.lstrip().startswith('{')
+
+
 bibfield_order = ['author', 'title', 'journal', 'institution', 'publisher',
                   'year', 'month', 'number', 'pages', 'link', 'doi', 'note',
                   'abstract']
+_FIELD_RANK = dict((key, rank) for rank, key in enumerate(bibfield_order))
+_FIELD_LINE = '    {} = {{{}}},\n'
 
 
 class EnDecoder(object):
@@ -66,14 +238,97 @@ class EnDecoder(object):
         * Returned content must be correctly formatted (no one else checks).
         * Failures raise ValueError
         * encode_bibdata will try to recognize exceptions
+        * Metadata is encoded in yaml, or in the more compact json when
+          metadata_format is 'json'. Both formats are always decoded.
+        * When cache_size is positive, decode_bibdata and decode_metadata
+          keep the last cache_size decoded contents, keyed by a digest of the
+          raw content. A copy is returned on each hit. cache_hits and
+          cache_misses count the lookups.
     """
 
+    def __init__(self, metadata_format='yaml', cache_size=0):
+        if metadata_format not in METADATA_FORMATS:
+            raise ValueError('unknown metadata format: {}'.format(metadata_format))
+        self.metadata_format = metadata_format
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._cache = collections.OrderedDict()
+
+    def _cached_decode(self, kind, raw, decode):
+        """Decode raw with decode, through the LRU cache."""
+        if self.cache_size <= 0:
+            return decode(raw)
+        key = (kind, hashlib.sha1(raw.encode('utf-8')).digest())
+        try:
+            pickled = self._cache.pop(key)
+        except KeyError:
+            self.cache_misses += 1
+            decoded = decode(raw)
+            if len(self._cache) >= self.cache_size:
+                self._cache.popitem(last=False)
+            self._cache[key] = pickle.dumps(decoded, pickle.HIGHEST_PROTOCOL)
+            return decoded
+        self.cache_hits += 1
+        self._cache[key] = pickled  # now the most recently used
+        return pickle.loads(pickled)
+
     def encode_metadata(self, metadata):
-        return yaml.safe_dump(metadata, allow_unicode=True,
-                              encoding=None, indent=4)
+        if self.metadata_format == 'json':
+            return json.dumps(metadata, default=_json_default,
+                              ensure_ascii=False, sort_keys=True)
+        return yaml.dump(metadata, Dumper=SafeDumper, allow_unicode=True,
+                         encoding=None, indent=4)
+
+    @staticmethod
+    def _decode_json_metadata(metadata_raw):
+        metadata = json.loads(metadata_raw)
+        if 'tags' in metadata:
+            metadata['tags'] = set(metadata['tags'])
+        if 'added' in metadata:
+            try:
+                metadata['added'] = parse_added(metadata['added'])
+            except (TypeError, ValueError):
+                pass  # left as is, as in yaml metadata
+        return metadata
 
     def decode_metadata(self, metadata_raw):
-        return yaml.safe_load(metadata_raw)
+        return self._cached_decode('meta', metadata_raw, self._decode_metadata)
+
+    def _decode_metadata(self, metadata_raw):
+        if _is_json(metadata_raw):
+            try:
+                return self._decode_json_metadata(metadata_raw)
+            except ValueError:
+                pass
+        return yaml.load(metadata_raw, Loader=SafeLoader)
+
+    def decode_many_metadata(self, metadata_raws):
+        """ Decode several metadata at once, the yaml ones as a single
+            yaml stream.
+
+            Falls back on decoding them one by one if the stream does not
+            hold exactly one document per metadata.
+            :returns: the list of decoded metadata, in order.
+        """
+        decoded = [None] * len(metadata_raws)
+        batch = []
+        for i, raw in enumerate(metadata_raws):
+            if _is_json(raw):
+                decoded[i] = self._decode_metadata(raw)
+            else:
+                batch.append(i)
+        if batch:
+            stream = ''.join('---\n{}\n'.format(metadata_raws[i]) for i in batch)
+            try:
+                documents = list(yaml.load_all(stream, Loader=SafeLoader))
+            except yaml.YAMLError:
+                documents = []
+            if len(documents) != len(batch):
+                documents = [self._decode_metadata(metadata_raws[i]) for i in batch]
+            for i, document in zip(batch, documents):
+                decoded[i] = document
+        return decoded
 
     def encode_bibdata(self, bibdata):
         """Encode bibdata """
@@ -97,34 +352,221 @@ class EnDecoder(object):
 
     @staticmethod
     def _encode_bibentry(citekey, bibentry):
-        bibraw = '@{}{{{},\n'.format(bibentry[TYPE_KEY], citekey)
-        bibentry = copy.copy(bibentry)
-        for key in bibfield_order:
-            if key in bibentry:
-                value = bibentry.pop(key)
-                bibraw += '    {} = {{{}}},\n'.format(
-                    key, EnDecoder._encode_field(key, value))
+        """ Encode an entry in a single pass over its fields, without copying
+            it: fields of bibfield_order are put in their slot, the others
+            follow in the order of the entry.
+        """
+        encode_field, field_line = EnDecoder._encode_field, _FIELD_LINE.format
+        ordered = [None] * len(bibfield_order)
+        lines = []
         for key, value in bibentry.items():
-            if key != TYPE_KEY:
-                bibraw += '    {} = {{{}}},\n'.format(
-                    key, EnDecoder._encode_field(key, value))
-        bibraw += '}\n'
-        return bibraw
+            rank = _FIELD_RANK.get(key)
+            if rank is not None:
+                ordered[rank] = field_line(key, encode_field(key, value))
+            elif key != TYPE_KEY:
+                lines.append(field_line(key, encode_field(key, value)))
+        head = '@{}{{{},\n'.format(bibentry[TYPE_KEY], citekey)
+        return ''.join([head] + [line for line in ordered if line is not None]
+                       + lines + ['}\n'])
+
+    @staticmethod
+    def _entry_from_record(record):
+        """Return (citekey, entry) from a bibtexparser record."""
+        # Remove id from bibtexparser attribute which is stored as citekey
+        citekey = record.pop(BP_ID_KEY)
+        # Convert bibtexparser entrytype key to internal 'type'
+        record[TYPE_KEY] = record.pop(BP_ENTRYTYPE_KEY)
+        return citekey, record
 
     def decode_bibdata(self, bibdata):
-        """"""
+        """ Decode bibdata, with a fast reader when it is a single entry in
+            the format written by encode_bibdata.
+        """
+        return self._cached_decode('bib', bibdata, self._decode_bibdata)
+
+    def _decode_bibdata(self, bibdata):
+        record = _read_canonical_entry(bibdata)
+        if record is not None:
+            return dict([self._entry_from_record(record)])
+        return self._parse_bibdata(bibdata)
+
+    def _parse_bibdata(self, bibdata):
+        """Decode bibdata with bibtexparser."""
         try:
             entries = bp.bparser.BibTexParser(
                 bibdata, customization=customizations).get_entry_dict()
-            # Remove id from bibtexparser attribute which is stored as citekey
-            for e in entries:
-                entries[e].pop(BP_ID_KEY)
-                # Convert bibtexparser entrytype key to internal 'type'
-                t = entries[e].pop(BP_ENTRYTYPE_KEY)
-                entries[e][TYPE_KEY] = t
+            entries = dict(self._entry_from_record(entry)
+                           for entry in entries.values())
             if len(entries) > 0:
                 return entries
         except Exception:
             import traceback
             traceback.print_exc()
         raise ValueError('could not parse bibdata')
+
+    def decode_entry(self, record, strings=None):
+        """ Decode a single bibtex record.
+
+            :param strings:  the @string macros the record may refer to, as
+                             a dictionary of lowercase names to values.
+            :returns: (citekey, entry)
+            :raise ValueError: if the record is not a single valid entry.
+        """
+        parsed = None if strings else _read_canonical_entry(record)
+        if parsed is None:
+            # only the macros the record names are handed to the parser
+            names = set(_MACRO_NAME_RE.findall(record.lower()))
+            macros = dict((name, strings[name]) for name in names
+                          if name in strings) if strings else {}
+            try:
+                entries = _string_parser(macros).parse(record).entries
+            except Exception as e:
+                raise ValueError('could not parse entry: {}'.format(e))
+            if len(entries) != 1:
+                raise ValueError('could not parse entry')
+            parsed = entries[0]
+        return self._entry_from_record(parsed)
+
+    def iter_bibdata(self, lines):
+        """ Decode bibtex entries one at a time, as lines are read.
+
+            :param lines:  iterable over the lines of a bibtex file, such as
+                           an open file.
+            :returns: generator of (citekey, entry). An entry that cannot be
+                decoded is replaced by a MalformedEntry error; its citekey is
+                None if it cannot be read either.
+        """
+        return self._decode_records(_iter_records(lines))
+
+    def _decode_records(self, records):
+        for lineno, strings, record in records:
+            try:
+                yield self.decode_entry(record, strings=strings)
+            except ValueError as e:
+                m = _ENTRY_HEAD_RE.match(record)
+                citekey = m.group(1) if m is not None else None
+                yield citekey, MalformedEntry(
+                    'line {}: {}'.format(lineno, e), lineno)
+
+    def decode_many_bibdata(self, bibdata_raws):
+        """ Decode several bibdata holding one entry each.
+
+            Bibdata in the format written by encode_bibdata are read by the
+            fast reader, the others with a single parser run. Bibdata that
+            do not look like a single entry, or a batch that does not
+            produce one entry per bibdata, are decoded one by one.
+            :returns: the list of decoded bibdata, in order.
+            :raise ValueError: if one of the bibdata cannot be decoded.
+        """
+        decoded = [None] * len(bibdata_raws)
+        batch = []
+        for i, raw in enumerate(bibdata_raws):
+            record = _read_canonical_entry(raw)
+            if record is not None:
+                decoded[i] = dict([self._entry_from_record(record)])
+            elif _count_records(raw) == 1:
+                batch.append(i)
+            else:
+                decoded[i] = self._parse_bibdata(raw)
+        if batch:
+            records = []
+            try:
+                records = bp.bparser.BibTexParser(
+                    '\n'.join(bibdata_raws[i] for i in batch),
+                    customization=customizations).entries
+            except Exception:
+                pass
+            if len(records) == len(batch):
+                for i, record in zip(batch, records):
+                    decoded[i] = dict([self._entry_from_record(record)])
+            else:
+                for i in batch:
+                    decoded[i] = self._parse_bibdata(bibdata_raws[i])
+        return decoded
+
+
+CHUNK_SIZE = 50  # raw files decoded per task sent to a worker
+
+
+def _decode_many_metadata(metadata_raws):
+    return EnDecoder().decode_many_metadata(metadata_raws)
+
+
+def _decode_many_bibdata(bibdata_raws):
+    return EnDecoder().decode_many_bibdata(bibdata_raws)
+
+
+def _decode_records(records):
+    return list(EnDecoder()._decode_records(records))
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class DecodingPool(object):
+    """ Decode content in a pool of worker processes.
+
+        Provides the decoding methods of EnDecoder, splitting the raw
+        content in chunks decoded in parallel. Results are returned in
+        the order of the raw content. The worker processes are only
+        started once there is more than one chunk to decode.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._pool = None
+
+    def _map(self, fun, items):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.workers)
+        return self._pool.map(fun, items)
+
+    def _decode_chunks(self, fun, raws):
+        raws = list(raws)
+        if len(raws) <= CHUNK_SIZE:
+            return fun(raws)
+        chunks = [raws[start:start + CHUNK_SIZE]
+                  for start in range(0, len(raws), CHUNK_SIZE)]
+        return [decoded for chunk in self._map(fun, chunks)
+                for decoded in chunk]
+
+    def decode_many_metadata(self, metadata_raws):
+        return self._decode_chunks(_decode_many_metadata, metadata_raws)
+
+    def decode_many_bibdata(self, bibdata_raws):
+        return self._decode_chunks(_decode_many_bibdata, bibdata_raws)
+
+    def iter_bibdata(self, lines):
+        """ Same as EnDecoder.iter_bibdata, decoding the entries by chunks.
+
+            Only a few chunks per worker are read ahead of the decoding.
+        """
+        window = []
+        for chunk in _chunks(_iter_records(lines), CHUNK_SIZE):
+            window.append(chunk)
+            if len(window) == 2 * self.workers:
+                for decoded in self._map(_decode_records, window):
+                    for item in decoded:
+                        yield item
+                window = []
+        if len(window) > 1:
+            decoded = self._map(_decode_records, window)
+        else:
+            decoded = [_decode_records(chunk) for chunk in window]
+        for items in decoded:
+            for item in items:
+                yield item
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
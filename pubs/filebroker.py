@@ -1,19 +1,46 @@
 import os
-import re
+import zlib
+import contextlib
 from .p3 import urlparse
 
 from .content import (check_file, check_directory, read_file, write_file,
                       system_path, check_content, content_type, get_content,
-                      copy_content)
+                      copy_content, file_stats, is_file, scandir,
+                      sync_files)
 
 
-def filter_filename(filename, ext):
-    """ Return the filename without the extension if the extension matches ext.
-        Otherwise return None
+FLAT_FORMAT = 1
+SHARDED_FORMAT = 2  # files are spread in 256 subdirectories
+
+
+def shard(citekey):
+    """Name of the subdirectory holding the files of citekey, when sharded."""
+    return '{:02x}'.format(zlib.crc32(citekey.encode('utf-8')) & 0xff)
+
+
+def _scan_citekeys(directories, ext, filestats=False):
+    """ List the citekeys of the files with extension ext in directories,
+        with a single pass on each of them.
+
+        :returns: a list of citekeys, and if filestats is True, the
+                  parallel list of the files stats.
     """
-    pattern ='.*\{}$'.format(ext)
-    if re.match(pattern, filename) is not None:
-        return filename[:-len(ext)]
+    citekeys, stats = [], []
+    cut = -len(ext)
+    for directory in directories:
+        for entry in scandir(directory):
+            name = entry.name
+            if name.endswith(ext) and len(name) > len(ext):
+                citekeys.append(name[:cut])
+                if filestats:
+                    stats.append(entry.stat())
+    if filestats:
+        return citekeys, stats
+    return citekeys
+
+
+def _subdirectories(directory):
+    return [entry.path for entry in scandir(directory) if entry.is_dir()]
 
 
 class FileBroker(object):
@@ -21,12 +48,21 @@ class FileBroker(object):
 
         * Does *absolutely no* encoding/decoding.
         * Communicate failure with exceptions.
+        * With the sharded layout, files are stored as bib/{shard}/{citekey}.bib,
+          where {shard} is derived from a hash of the citekey. This keeps
+          directories small for large repositories.
     """
 
-    def __init__(self, directory, create=False):
+    transactional = False  # the writes of a failed batch stay on disk
+
+    def __init__(self, directory, create=False, sharded=False):
         self.directory = directory
+        self.sharded = sharded
         self.metadir = os.path.join(self.directory, 'meta')
         self.bibdir  = os.path.join(self.directory, 'bib')
+        self._shards = set()  # shard directories known to exist
+        self._written = None  # files written or removed in the current batch
+        self._batch_depth = 0
         if create:
             self._create()
         check_directory(self.directory)
@@ -41,70 +77,168 @@ class FileBroker(object):
         if not check_directory(self.bibdir, fail = False):
             os.mkdir(system_path(self.bibdir))
 
+    def _filepath(self, directory, citekey, ext, sharded=None):
+        if sharded is None:
+            sharded = self.sharded
+        if sharded:
+            return os.path.join(directory, shard(citekey), citekey + ext)
+        return os.path.join(directory, citekey + ext)
+
+    def _metapath(self, citekey):
+        return self._filepath(self.metadir, citekey, '.yaml')
+
+    def _bibpath(self, citekey):
+        return self._filepath(self.bibdir, citekey, '.bib')
+
+    def _check_shard(self, filepath):
+        """Create the shard directory of filepath if needed."""
+        shard_dir = os.path.dirname(filepath)
+        if shard_dir not in self._shards:
+            if not check_directory(shard_dir, fail=False):
+                os.mkdir(system_path(shard_dir))
+            self._shards.add(shard_dir)
+
+    def _directories(self, directory):
+        if self.sharded:
+            return _subdirectories(directory)
+        return [directory]
+
     def pull_metafile(self, citekey):
-        filepath = os.path.join(self.metadir, citekey + '.yaml')
-        return read_file(filepath)
+        return read_file(self._metapath(citekey))
 
     def pull_bibfile(self, citekey):
-        filepath = os.path.join(self.bibdir, citekey + '.bib')
-        return read_file(filepath)
+        return read_file(self._bibpath(citekey))
+
+    def pull_metafiles(self, citekeys):
+        """Return the content of several metafiles, in the order of citekeys."""
+        return [read_file(self._metapath(citekey), check=False)
+                for citekey in citekeys]
+
+    def pull_bibfiles(self, citekeys):
+        """Return the content of several bibfiles, in the order of citekeys."""
+        return [read_file(self._bibpath(citekey), check=False)
+                for citekey in citekeys]
+
+    def stat_metafile(self, citekey):
+        return file_stats(self._metapath(citekey))
+
+    def stat_bibfile(self, citekey):
+        return file_stats(self._bibpath(citekey))
+
+    def _write(self, filepath, data):
+        if self.sharded:
+            self._check_shard(filepath)
+        if self._written is None:
+            write_file(filepath, data)
+        else:  # synced at the end of the batch
+            write_file(filepath, data, sync=False, check=False)
+            self._written.append(filepath)
 
     def push_metafile(self, citekey, metadata):
         """Put content to disk. Will gladly override anything standing in its way."""
-        filepath = os.path.join(self.metadir, citekey + '.yaml')
-        write_file(filepath, metadata)
+        self._write(self._metapath(citekey), metadata)
 
     def push_bibfile(self, citekey, bibdata):
         """Put content to disk. Will gladly override anything standing in its way."""
-        filepath = os.path.join(self.bibdir, citekey + '.bib')
-        write_file(filepath, bibdata)
+        self._write(self._bibpath(citekey), bibdata)
 
     def push(self, citekey, metadata, bibdata):
         """Put content to disk. Will gladly override anything standing in its way."""
         self.push_metafile(citekey, metadata)
         self.push_bibfile(citekey, bibdata)
 
+    @contextlib.contextmanager
+    def batch(self):
+        """ Same interface as SQLiteBroker.batch().
+
+            Files are still written immediately and atomically, but are
+            not synced one by one: they are synced together, and then
+            their directories once each, when the outermost batch ends.
+            Unlike with SQLite, the writes are not rolled back if the block
+            fails.
+        """
+        if self._batch_depth == 0:
+            self._written = []
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                written, self._written = self._written, None
+                sync_files(written)
+
     def remove(self, citekey):
-        metafilepath = os.path.join(self.metadir, citekey + '.yaml')
-        if check_file(metafilepath):
-            os.remove(system_path(metafilepath))
-        bibfilepath = os.path.join(self.bibdir, citekey + '.bib')
-        if check_file(bibfilepath):
-            os.remove(system_path(bibfilepath))
+        for filepath in (self._metapath(citekey), self._bibpath(citekey)):
+            if is_file(filepath):
+                os.remove(system_path(filepath))
+                if self._written is not None:
+                    self._written.append(filepath)
 
     def exists(self, citekey, meta_check=False):
         """ Checks wether the bibtex of a citekey exists.
 
             :param meta_check:  if True, will return if both the bibtex and the meta file exists.
         """
-        does_exists = check_file(os.path.join(self.bibdir, citekey + '.bib'), fail=False)
+        does_exists = is_file(self._bibpath(citekey))
         if meta_check:
-            meta_exists = check_file(os.path.join(self.metadir, citekey + '.yaml'), fail=False)
-            does_exists = does_exists and meta_exists
+            does_exists = does_exists and is_file(self._metapath(citekey))
         return does_exists
 
+    def citekeys(self):
+        """List the citekeys of the bibfiles, without reading the metadir."""
+        return _scan_citekeys(self._directories(self.bibdir), '.bib')
+
+    def citekeys_stamp(self):
+        """ Return the modification times of the directories holding the
+            bibfiles: the citekeys did not change as long as it is the same.
+        """
+        directories = [self.bibdir]
+        if self.sharded:
+            directories.extend(_subdirectories(self.bibdir))
+        return tuple(sorted((directory, os.stat(system_path(directory)).st_mtime)
+                            for directory in directories))
+
     def listing(self, filestats=True):
-        metafiles = []
-        for filename in os.listdir(system_path(self.metadir)):
-            citekey = filter_filename(filename, '.yaml')
-            if citekey is not None:
-                if filestats:
-                    stats = os.stat(system_path(os.path.join(self.metadir, filename)))
-                    metafiles.append(citekey, stats)
-                else:
-                    metafiles.append(citekey)
-
-        bibfiles = []
-        for filename in os.listdir(system_path(self.bibdir)):
-            citekey = filter_filename(filename, '.bib')
-            if citekey is not None:
-                if filestats:
-                    stats = os.stat(system_path(os.path.join(self.bibdir, filename)))
-                    bibfiles.append(citekey, stats)
-                else:
-                    bibfiles.append(citekey)
+        """ List the citekeys of the meta and bib files.
 
-        return {'metafiles': metafiles, 'bibfiles': bibfiles}
+            :param filestats:  if True, the stats of the files are provided
+                               in 'metastats' and 'bibstats', as lists
+                               parallel to the 'metafiles' and 'bibfiles'
+                               lists of citekeys.
+        """
+        metadirs = self._directories(self.metadir)
+        bibdirs = self._directories(self.bibdir)
+        if not filestats:
+            return {'metafiles': _scan_citekeys(metadirs, '.yaml'),
+                    'bibfiles':  _scan_citekeys(bibdirs, '.bib')}
+        metafiles, metastats = _scan_citekeys(metadirs, '.yaml', filestats=True)
+        bibfiles,  bibstats  = _scan_citekeys(bibdirs, '.bib', filestats=True)
+        return {'metafiles': metafiles, 'metastats': metastats,
+                'bibfiles':  bibfiles,  'bibstats':  bibstats}
+
+    def convert_layout(self, sharded):
+        """ Move the meta and bib files to the sharded or the flat layout.
+
+            Files are looked for in both layouts, so that an interrupted
+            conversion can be completed by running it again.
+        """
+        for directory, ext in ((self.metadir, '.yaml'), (self.bibdir, '.bib')):
+            subdirs = _subdirectories(directory)
+            for sourcedir in [directory] + subdirs:
+                for citekey in _scan_citekeys([sourcedir], ext):
+                    source = os.path.join(sourcedir, citekey + ext)
+                    target = self._filepath(directory, citekey, ext, sharded=sharded)
+                    if source != target:
+                        if sharded:
+                            self._check_shard(target)
+                        os.rename(system_path(source), system_path(target))
+            if not sharded:
+                for subdir in subdirs:
+                    if len(os.listdir(system_path(subdir))) == 0:
+                        os.rmdir(system_path(subdir))
+        self.sharded = sharded
+        self._shards = set()
 
 
 class DocBroker(object):
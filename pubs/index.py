@@ -0,0 +1,411 @@
+import os
+import re
+import time
+import bisect
+import pickle
+
+from . import bibstruct
+from .datacache import ChangeTracker, PICKLE_PROTOCOL, RACY_DELAY, _stamp
+from .content import check_file, file_stats, read_byte_file, write_byte_file
+
+
+INDEX_FILE = '.index'
+INDEX_VERSION = 5
+CITEKEYS_FILE = '.citekeys'
+SUMMARIES_FILE = '.summaries'
+
+# Indexed fields, all terms are lowercase.
+FIELDS = ('author', 'title', 'tag', 'year', 'type')
+# Tags as they are written, for exact lookups.
+TAGS = 'tags'
+POSTINGS = FIELDS + (TAGS,)
+
+# Fields of the bibdata kept to display the oneliners of papers.
+SUMMARY_FIELDS = ('author', 'title', 'journal', 'booktitle', 'year',
+                  bibstruct.TYPE_KEY)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _tokens(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def _base27(n):
+    return _base27((n - 1) // 26) + chr(ord('a') + ((n - 1) % 26)) if n else ''
+
+
+def _base27_value(s):
+    """Inverse of _base27, None if s is not made of lowercase letters."""
+    n = 0
+    for c in s:
+        if not 'a' <= c <= 'z':
+            return None
+        n = 26 * n + ord(c) - ord('a') + 1
+    return n
+
+
+def _load_data(path, version):
+    """Return the pickled data in path, None if missing, outdated or corrupted."""
+    if check_file(path, fail=False):
+        try:
+            data = pickle.loads(read_byte_file(path))
+            if data.get('version') == version:
+                return data
+        except Exception:  # corrupted file, it is rebuilt
+            pass
+    return None
+
+
+def _save_data(path, data):
+    # the file is rebuilt if lost, it does not need to be synced
+    write_byte_file(path, pickle.dumps(data, PICKLE_PROTOCOL), sync=False)
+
+
+def paper_terms(bibdata, metadata):
+    """ Return the terms of a paper, as a dictionary from the fields of
+        POSTINGS to sets of terms.
+
+        Authors are indexed by last name, titles by word.
+    """
+    terms = dict((field, set()) for field in POSTINGS)
+    for author in bibdata.get('author', []):
+        terms['author'].add(bibstruct.author_last(author).lower())
+    terms['title'].update(_tokens(bibdata.get('title', '')))
+    for tag in (metadata or {}).get('tags', []):
+        terms['tag'].add(tag.lower())
+        terms[TAGS].add(tag)
+    for field in ('year', 'type'):
+        if field in bibdata:
+            terms[field].add(bibdata[field].lower())
+    return terms
+
+
+class Index(object):
+    """ Persistent inverted index of the papers of the repository.
+
+        Maps the terms of the fields of FIELDS (author last names, title
+        words, tags, years and entry types) to the citekeys of the papers
+        holding them. Tags are also kept with their case, under TAGS.
+        The index is stored in the pubs directory, along with the stamps
+        of the indexed files: when loaded, it is brought up-to-date by
+        indexing again only the papers whose files changed.
+
+        :param datacache:  the DataCache of the repository.
+    """
+
+    def __init__(self, datacache):
+        self.datacache = datacache
+        self.path = os.path.join(datacache.directory, INDEX_FILE)
+        self.modified = False
+        self._data = self._load()
+        self.update()
+
+    def _empty(self):
+        return {'version': INDEX_VERSION, 'manifest': {}, 'papers': {},
+                'postings': dict((field, {}) for field in POSTINGS)}
+
+    def _load(self):
+        data = _load_data(self.path, INDEX_VERSION)
+        return data if data is not None else self._empty()
+
+    def save(self):
+        """Write the index to disk, if it changed since it was loaded."""
+        if self.modified:
+            _save_data(self.path, self._data)
+            self.modified = False
+
+    def update(self):
+        """Index again the papers whose files changed since the last update."""
+        tracker = ChangeTracker(self.datacache.databroker, self._data['manifest'])
+        added, modified, removed = tracker.changes()
+        for citekey in removed:
+            self.remove(citekey)
+        changed = sorted(added.union(modified))
+        try:
+            for citekey, bibentry, metadata in self.datacache.pull_many(changed):
+                self.add(citekey, bibstruct.get_entry(bibentry)[1], metadata)
+        except (IOError, ValueError, KeyError):
+            # some papers cannot be read, index what can be read
+            for citekey in changed:
+                try:
+                    bibentry = self.datacache.pull_bibentry(citekey)
+                    metadata = self.datacache.pull_metadata(citekey)
+                    self.add(citekey, bibstruct.get_entry(bibentry)[1], metadata)
+                except (IOError, ValueError, KeyError):
+                    self.remove(citekey)
+                    del tracker.manifest[citekey]  # tried again next time
+        self._data['manifest'] = tracker.manifest
+        if added or modified or removed:
+            self.modified = True
+
+    def add(self, citekey, bibdata, metadata):
+        """Index a paper, replacing its previous terms."""
+        self.remove(citekey)
+        terms = paper_terms(bibdata, metadata)
+        self._data['papers'][citekey] = terms
+        for field, field_terms in terms.items():
+            postings = self._data['postings'][field]
+            for term in field_terms:
+                postings.setdefault(term, set()).add(citekey)
+        self.modified = True
+
+    def remove(self, citekey):
+        """Remove a paper from the index. Is silent if it is not indexed."""
+        terms = self._data['papers'].pop(citekey, None)
+        if terms is None:
+            return
+        for field, field_terms in terms.items():
+            postings = self._data['postings'][field]
+            for term in field_terms:
+                postings[term].discard(citekey)
+                if not postings[term]:
+                    del postings[term]
+        self.modified = True
+
+    def __contains__(self, citekey):
+        return citekey in self._data['papers']
+
+    def citekeys(self):
+        return set(self._data['papers'])
+
+    def terms(self, field):
+        """Return the indexed terms of a field."""
+        return set(self._data['postings'][field])
+
+    def tags(self):
+        """Return the tags of all the papers."""
+        return self.terms(TAGS)
+
+    def tagged(self, included=(), excluded=()):
+        """ Return the citekeys of the papers with all the included tags
+            and none of the excluded ones.
+        """
+        postings = self._data['postings'][TAGS]
+        citekeys = self.citekeys()
+        for tag in included:
+            citekeys.intersection_update(postings.get(tag, ()))
+        for tag in excluded:
+            citekeys.difference_update(postings.get(tag, ()))
+        return citekeys
+
+    def lookup(self, field, term):
+        """Return the citekeys of the papers holding exactly term."""
+        return set(self._data['postings'][field].get(term, ()))
+
+    def _containing(self, field, needle):
+        citekeys = set()
+        for term, term_citekeys in self._data['postings'][field].items():
+            if needle in term:
+                citekeys.update(term_citekeys)
+        return citekeys
+
+    def search(self, field, needle):
+        """ Return the citekeys of the papers that may hold needle as a
+            substring of the field, ignoring case.
+
+            The result includes all the papers that do hold it, but may
+            include others: for titles, the words of needle are looked
+            for separately.
+        """
+        needle = needle.lower()
+        if field != 'title':
+            return self._containing(field, needle)
+        words = _tokens(needle)
+        if not words:
+            return self.citekeys()
+        citekeys = self._containing(field, words[0])
+        for word in words[1:]:
+            citekeys.intersection_update(self._containing(field, word))
+        return citekeys
+
+    def search_years(self, first=None, last=None):
+        """Return the citekeys of the papers with a year in [first, last]."""
+        citekeys = set()
+        for term, term_citekeys in self._data['postings']['year'].items():
+            try:
+                year = int(term)
+            except ValueError:
+                continue
+            if (first is None or first <= year) and (last is None or year <= last):
+                citekeys.update(term_citekeys)
+        return citekeys
+
+
+class CitekeyIndex(object):
+    """ Sorted list of the citekeys of the repository, for prefix lookups.
+
+        It is stored apart from the Index, in CITEKEYS_FILE, so that it is
+        loaded without the postings, along with the stamp of the bib
+        directories (see FileBroker.citekeys_stamp). It is only listed and
+        sorted again when that stamp changed.
+
+        For each base key given to free_suffix, it also keeps the suffixes
+        used by the citekeys made of the base key and a suffix (see
+        _base27), and the smallest free one.
+
+        :param datacache:  the DataCache of the repository.
+        :param citekeys:   the set of the citekeys of the repository, if
+                           already listed.
+    """
+
+    def __init__(self, datacache, citekeys=None):
+        self.datacache = datacache
+        self.path = os.path.join(datacache.directory, CITEKEYS_FILE)
+        self.modified = False
+        data = _load_data(self.path, INDEX_VERSION)
+        if data is not None and self._fresh(data['stamp']):
+            self._citekeys = data['citekeys']
+            self._suffixes = data['suffixes']
+        else:
+            if citekeys is None:
+                citekeys = datacache.citekeys()
+            self._citekeys = sorted(citekeys)
+            self._suffixes = {}
+            self.modified = True
+
+    def _fresh(self, stamp):
+        """ True if the bib directories did not change since stamp.
+
+            As the stamp is taken when the file is saved, directories
+            modified in the same timestamp tick as the file are racy:
+            another change in that tick would go unnoticed.
+        """
+        if stamp is None or stamp != self.datacache.citekeys_stamp():
+            return False
+        saved = file_stats(self.path).st_mtime
+        return max(mtime for _, mtime in stamp) < saved
+
+    def save(self):
+        """ Write the citekeys to disk, if they changed since they were
+            loaded, with the current stamp of the bib directories.
+        """
+        if self.modified:
+            _save_data(self.path, {'version': INDEX_VERSION,
+                                   'stamp': self.datacache.citekeys_stamp(),
+                                   'citekeys': self._citekeys,
+                                   'suffixes': self._suffixes})
+            self.modified = False
+
+    def _update_suffixes(self, citekey, used):
+        for i in range(len(citekey) + 1):
+            suffixes = self._suffixes.get(citekey[:i])
+            if suffixes is None:
+                continue
+            n = _base27_value(citekey[i:])
+            if n is None:
+                continue
+            if used:
+                suffixes[1].add(n)
+                while suffixes[0] in suffixes[1]:
+                    suffixes[0] += 1
+            else:
+                suffixes[1].discard(n)
+                suffixes[0] = min(suffixes[0], n)
+            self.modified = True
+
+    def add(self, citekey):
+        """Add a citekey. Is silent if it is already there."""
+        i = bisect.bisect_left(self._citekeys, citekey)
+        if i == len(self._citekeys) or self._citekeys[i] != citekey:
+            self._citekeys.insert(i, citekey)
+            self._update_suffixes(citekey, True)
+            self.modified = True
+
+    def remove(self, citekey):
+        """Remove a citekey. Is silent if it is not there."""
+        i = bisect.bisect_left(self._citekeys, citekey)
+        if i < len(self._citekeys) and self._citekeys[i] == citekey:
+            del self._citekeys[i]
+            self._update_suffixes(citekey, False)
+            self.modified = True
+
+    def free_suffix(self, base_key):
+        """ Return the smallest suffix n such that base_key + _base27(n)
+            is not a citekey.
+
+            The suffixes of a base key are read from the citekeys
+            beginning with it the first time only, and then kept up-to-date
+            by add and remove.
+        """
+        suffixes = self._suffixes.get(base_key)
+        if suffixes is None:
+            used = set()
+            for citekey in self.citekeys_from_prefix(base_key):
+                n = _base27_value(citekey[len(base_key):])
+                if n is not None:
+                    used.add(n)
+            suffixes = self._suffixes[base_key] = [0, used]
+            while suffixes[0] in used:
+                suffixes[0] += 1
+            self.modified = True
+        return suffixes[0]
+
+    def citekeys_from_prefix(self, prefix):
+        """Return the sorted citekeys beginning with prefix."""
+        citekeys = self._citekeys
+        start = bisect.bisect_left(citekeys, prefix)
+        end = start
+        while end < len(citekeys) and citekeys[end].startswith(prefix):
+            end += 1
+        return citekeys[start:end]
+
+
+class Summaries(object):
+    """ Summaries of papers, enough to display their oneliners.
+
+        Each summary holds the fields of SUMMARY_FIELDS of the bibdata and
+        the tags of a paper. The summaries are stored in SUMMARIES_FILE,
+        with the stamps of the files they were read from: a summary is used
+        as long as the stats of its files are unchanged, and read again
+        from the files otherwise. Only the files of the requested papers
+        are looked at.
+
+        :param datacache:  the DataCache of the repository.
+    """
+
+    def __init__(self, datacache):
+        self.datacache = datacache
+        self.path = os.path.join(datacache.directory, SUMMARIES_FILE)
+        self.modified = False
+        data = _load_data(self.path, INDEX_VERSION)
+        self._summaries = data['summaries'] if data is not None else {}
+
+    def save(self):
+        """Write the summaries to disk, if they changed since they were loaded."""
+        if self.modified:
+            _save_data(self.path, {'version': INDEX_VERSION,
+                                   'summaries': self._summaries})
+            self.modified = False
+
+    def discard(self, citekey):
+        if self._summaries.pop(citekey, None) is not None:
+            self.modified = True
+
+    def summary(self, citekey):
+        """ Return (bibdata, tags) for a paper, where bibdata only holds
+            the fields of SUMMARY_FIELDS.
+
+            :raise IOError: if the files of the paper cannot be read.
+        """
+        databroker = self.datacache.databroker
+        bibstats = databroker.stat_bibfile(citekey)
+        metastats = databroker.stat_metafile(citekey)
+        stamps = (_stamp(bibstats), _stamp(metastats))
+        cached = self._summaries.get(citekey)
+        if cached is None or cached[0] != stamps:
+            bibentry = self.datacache.pull_bibentry(citekey)
+            bibdata = bibstruct.get_entry(bibentry)[1]
+            metadata = self.datacache.pull_metadata(citekey)
+            cached = (stamps,
+                      dict((field, bibdata[field]) for field in SUMMARY_FIELDS
+                           if field in bibdata),
+                      set(metadata.get('tags', ())))
+            racy = time.time() - RACY_DELAY
+            if max(bibstats.st_mtime, bibstats.st_ctime,
+                   metastats.st_mtime, metastats.st_ctime) < racy:
+                self._summaries[citekey] = cached
+                self.modified = True
+            else:
+                self.discard(citekey)
+        return dict(cached[1]), set(cached[2])
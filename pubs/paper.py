@@ -1,5 +1,6 @@
+import re
 import copy
-from dateutil.parser import parse as datetime_parse
+from datetime import datetime
 
 from . import bibstruct
 from .p3 import ustr
@@ -7,13 +8,43 @@ from .p3 import ustr
 
 DEFAULT_META = {'docfile': None, 'tags': set()}
 
+# The formats of the added date written by pubs, as datetime.isoformat()
+# (json metadata) or str(datetime) (yaml metadata).
+_ADDED_RE = re.compile(r'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:\.(\d{6}))?$')
+
+
+def _parse_isoformat(date):
+    m = _ADDED_RE.match(date)
+    if m is None:
+        raise ValueError('not an iso formatted date: {}'.format(date))
+    fields = [int(f) for f in m.group(1, 2, 3, 4, 5, 6)]
+    return datetime(*fields, microsecond=int(m.group(7) or 0))
+
+try:
+    _fromisoformat = datetime.fromisoformat
+except AttributeError:  # python < 3.7
+    _fromisoformat = _parse_isoformat
+
+
+def parse_added(date):
+    """ Parse the added date of a paper.
+
+        The formats written by pubs are parsed directly; dateutil is only
+        imported, and used, for other formats.
+    """
+    try:
+        return _fromisoformat(date)
+    except ValueError:
+        from dateutil.parser import parse as datetime_parse
+        return datetime_parse(date)
+
 
 def _clean_metadata(metadata):
     meta = copy.deepcopy(DEFAULT_META)
     meta.update(metadata or {})  # handles None metadata
     meta['tags'] = set(meta.get('tags', []))  # tags should be a set
     if 'added' in meta and isinstance(meta['added'], ustr):
-        meta['added'] = datetime_parse(meta['added'])
+        meta['added'] = parse_added(meta['added'])
     return meta
 
 
@@ -34,6 +65,18 @@ class Paper(object):
         self.bibdata = bibdata
         bibstruct.check_citekey(self.citekey)
 
+    @property
+    def bibdata(self):
+        if self._pull_bibdata is not None:
+            self._bibdata = self._pull_bibdata()
+            self._pull_bibdata = None
+        return self._bibdata
+
+    @bibdata.setter
+    def bibdata(self, value):
+        self._pull_bibdata = None
+        self._bibdata = value
+
     def __eq__(self, other):
         return (isinstance(self, Paper) and type(other) is type(self)
             and self.bibdata  == other.bibdata
@@ -108,3 +151,12 @@ class Paper(object):
         if citekey is None:
             citekey = bibentry_key
         return Paper(citekey, bibdata, metadata=metadata)
+
+    @staticmethod
+    def lazy(citekey, pull_bibdata, metadata=None):
+        """ Paper whose bibdata is only loaded, by calling pull_bibdata(),
+            when first accessed.
+        """
+        paper = Paper(citekey, None, metadata=metadata)
+        paper._pull_bibdata = pull_bibdata
+        return paper
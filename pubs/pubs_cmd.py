@@ -27,15 +27,14 @@ CORE_CMDS = collections.OrderedDict([
 
         ('websearch',   commands.websearch_cmd),
         ('edit',        commands.edit_cmd),
-        # ('update',      commands.update_cmd),
+        ('update',      commands.update_cmd),
         ])
 
 
 def _update_check(config, ui):
     if config.version_warning:
         code_version = __version__.split('.')
-        if len(config.version) == 1: # support for deprecated version scheme.
-            config.version = '0.{}.0'.format(config.version)
+        configs.normalize_version(config)
         repo_version = config.version.split('.')
 
         if repo_version > code_version:
@@ -69,7 +68,8 @@ def execute(raw_args=sys.argv):
     uis.init_ui(config)
     ui = uis.get_ui()
 
-    _update_check(config, ui)
+    if len(raw_args) < 2 or raw_args[1] != 'update':
+        _update_check(config, ui)
 
     parser = argparse.ArgumentParser(description="research papers repository")
     subparsers = parser.add_subparsers(title="valid commands", dest="command")
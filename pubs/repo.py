@@ -1,15 +1,13 @@
-import itertools
+import contextlib
 from datetime import datetime
 
 from . import bibstruct
 from . import events
 from .datacache import DataCache
+from .index import Index, CitekeyIndex, Summaries, _base27
 from .paper import Paper
 from .content import system_path
-
-
-def _base27(n):
-    return _base27((n - 1) // 26) + chr(ord('a') + ((n - 1) % 26)) if n else ''
+from .filebroker import SHARDED_FORMAT
 
 
 class CiteKeyCollision(Exception):
@@ -25,7 +23,16 @@ class Repository(object):
     def __init__(self, config, create=False):
         self.config = config
         self._citekeys = None
-        self.databroker = DataCache(self.config.pubsdir, create=create)
+        self._index = None
+        self._citekey_index = None
+        self._summaries = None
+        self._pending_events = None  # events held until the batch ends
+        sharded = int(self.config.repo_format) == SHARDED_FORMAT
+        self.databroker = DataCache(self.config.pubsdir, create=create,
+                                    sharded=sharded,
+                                    storage=self.config.storage,
+                                    workers=int(self.config.decode_workers),
+                                    metadata_format=self.config.metadata_format)
 
     @property
     def citekeys(self):
@@ -33,12 +40,96 @@ class Repository(object):
             self._citekeys = self.databroker.citekeys()
         return self._citekeys
 
+    @property
+    def index(self):
+        """ The inverted index of the papers, loaded and brought up-to-date
+            on first access.
+
+            While loaded, the index is updated by push_paper and remove_paper.
+            Otherwise, the changes are picked up the next time it is loaded.
+        """
+        if self._index is None:
+            self._index = Index(self.databroker)
+            self._index.save()
+            self.databroker.save_snapshot()  # keeps what the update decoded
+        return self._index
+
+    @property
+    def citekey_index(self):
+        """ The sorted citekeys of the repository, listed again on first
+            access only if the bib directories changed since it was saved.
+            While loaded, it is updated by push_paper and remove_paper.
+        """
+        if self._citekey_index is None:
+            self._citekey_index = CitekeyIndex(self.databroker, self._citekeys)
+            self._citekey_index.save()
+        return self._citekey_index
+
+    @property
+    def summaries(self):
+        if self._summaries is None:
+            self._summaries = Summaries(self.databroker)
+        return self._summaries
+
+    @contextlib.contextmanager
+    def batch(self):
+        """ Group the pushes and removes of the block.
+
+            The files are written atomically and synced to disk together,
+            with their directories, at the end of the block (in a single transaction
+            with the sqlite storage). The index is saved once, and the events are
+            sent only after the writes are committed. If the block fails
+            and the storage rolled the writes back (sqlite), the events are
+            dropped and the indexes are reloaded on next use. Otherwise the
+            writes done before the failure stay: the indexes are saved and
+            the events of these writes are sent.
+        """
+        if self._pending_events is not None:  # nested batch
+            yield
+            return
+        self._pending_events = []
+        try:
+            with self.databroker.batch():
+                yield
+        except BaseException:
+            pending_events, self._pending_events = self._pending_events, None
+            if self.databroker.transactional:
+                self._index = None
+                self._citekey_index = None
+                self._citekeys = None
+            else:
+                self._save_index()
+                for event in pending_events:
+                    event.send()
+            raise
+        pending_events, self._pending_events = self._pending_events, None
+        self._save_index()
+        for event in pending_events:
+            event.send()
+
+    def _send(self, event):
+        if self._pending_events is None:
+            event.send()
+        else:
+            self._pending_events.append(event)
+
+    def _save_index(self):
+        """Save the loaded indexes, unless a batch is running."""
+        if self._pending_events is None:
+            for index in (self._index, self._citekey_index):
+                if index is not None:
+                    index.save()
+
     def __contains__(self, citekey):
         """ Allows to use 'if citekey in repo' pattern
 
         The convention is that the paper is in the repository
-        if and only if a bibfile is in the repository.
+        if and only if a bibfile is in the repository. Once the citekeys
+        are listed, the answer comes from them, otherwise from a single
+        check of the bibfile.
         """
+        if self._citekeys is not None:
+            return citekey in self._citekeys
         return self.databroker.exists(citekey)
 
     def __len__(self):
@@ -47,24 +138,83 @@ class Repository(object):
 
     # papers
     def all_papers(self):
-        for key in self.citekeys:
-            yield self.pull_paper(key)
+        return self.pull_papers()
 
     def citekeys_from_prefix(self, prefix):
-        """Return all citekey beginning with prefix."""
-        return tuple(citekey for citekey in self.citekeys
-                     if citekey.startswith(prefix))
+        """Return all citekey beginning with prefix, from the citekey index."""
+        return tuple(self.citekey_index.citekeys_from_prefix(prefix))
+
+    def pull_paper_summaries(self, citekeys):
+        """ Return the list of papers of citekeys, from their stored
+            summaries. Only the files that changed are read.
+
+            Their bibdata only holds the fields needed by their oneliners,
+            and their metadata only their tags.
+        """
+        papers = []
+        for citekey in citekeys:
+            if citekey not in self:
+                raise InvalidReference('{} citekey not found'.format(citekey))
+            bibdata, tags = self.summaries.summary(citekey)
+            papers.append(Paper(citekey, bibdata, metadata={'tags': tags}))
+        self.summaries.save()
+        return papers
 
-    def pull_paper(self, citekey):
-        """Load a paper by its citekey from disk, if necessary."""
+    def pull_paper_summary(self, citekey):
+        """Return a paper from its stored summary, see pull_paper_summaries."""
+        return self.pull_paper_summaries([citekey])[0]
+
+    def _lazy_paper(self, citekey, metadata):
+        def pull_bibdata():
+            return bibstruct.get_entry(self.databroker.pull_bibentry(citekey))[1]
+        return Paper.lazy(citekey, pull_bibdata, metadata=metadata)
+
+    def pull_paper(self, citekey, lazy=False):
+        """ Load a paper by its citekey from disk, if necessary.
+
+            :param lazy:  if True, the bibfile is only read and decoded when
+                          the bibdata of the paper is first accessed.
+        """
         if citekey in self:
+            metadata = self.databroker.pull_metadata(citekey)
+            if lazy:
+                return self._lazy_paper(citekey, metadata)
             return Paper.from_bibentry(
                 self.databroker.pull_bibentry(citekey),
-                citekey=citekey,
-                metadata=self.databroker.pull_metadata(citekey))
+                citekey=citekey, metadata=metadata)
         else:
             raise InvalidReference('{} citekey not found'.format(citekey))
 
+    def pull_papers(self, citekeys=None, lazy=False, cached=True):
+        """ Load several papers from disk, reading and decoding the files
+            by batches.
+
+            :param citekeys:  if None, all the papers of the repository.
+            :param lazy:      if True, only the metafiles are read; the
+                              bibdata of each paper is loaded when first
+                              accessed.
+            :param cached:    if False, the files are read without going
+                              through the cache snapshot, which is neither
+                              loaded nor filled; memory stays bounded by
+                              the batch size. Ignored for lazy pulls.
+        """
+        if citekeys is not None:
+            citekeys = list(citekeys)
+            for citekey in citekeys:
+                if citekey not in self.citekeys:
+                    raise InvalidReference('{} citekey not found'.format(citekey))
+        if lazy:
+            for citekey, metadata in self.databroker.pull_many_metadata(citekeys):
+                yield self._lazy_paper(citekey, metadata)
+            self.databroker.save_snapshot()
+        else:
+            broker = self.databroker if cached else self.databroker.databroker
+            for citekey, bibentry, metadata in broker.pull_many(citekeys):
+                yield Paper.from_bibentry(bibentry, citekey=citekey,
+                                          metadata=metadata)
+            if cached:
+                self.databroker.save_snapshot()
+
     def push_paper(self, paper, overwrite=False, event=True):
         """ Push a paper to disk
 
@@ -78,15 +228,21 @@ class Repository(object):
             paper.added = datetime.now()
         self.databroker.push_bibentry(paper.citekey, paper.bibentry)
         self.databroker.push_metadata(paper.citekey, paper.metadata)
-        self.citekeys.add(paper.citekey)
+        if self._citekeys is not None:
+            self._citekeys.add(paper.citekey)
+        if self._citekey_index is not None:
+            self._citekey_index.add(paper.citekey)
+        if self._index is not None:
+            self._index.add(paper.citekey, paper.bibdata, paper.metadata)
+        self._save_index()
         if event:
-            events.AddEvent(paper.citekey).send()
+            self._send(events.AddEvent(paper.citekey))
 
     def remove_paper(self, citekey, remove_doc=True, event=True):
         """ Remove a paper. Is silent if nothing needs to be done."""
 
         if event:
-            events.RemoveEvent(citekey).send()
+            self._send(events.RemoveEvent(citekey))
         if remove_doc:
             try:
                 metadata = self.databroker.pull_metadata(citekey)
@@ -97,8 +253,16 @@ class Repository(object):
                 pass # FXME: if IOError is about being unable to
                      # remove the file, we need to issue an error.I
 
-        self.citekeys.remove(citekey)
+        if self._citekeys is not None:
+            self._citekeys.remove(citekey)
         self.databroker.remove(citekey)
+        if self._citekey_index is not None:
+            self._citekey_index.remove(citekey)
+        if self._summaries is not None:
+            self._summaries.discard(citekey)
+        if self._index is not None:
+            self._index.remove(citekey)
+        self._save_index()
 
     def rename_paper(self, paper, new_citekey=None, old_citekey=None):
         if old_citekey is None:
@@ -124,11 +288,12 @@ class Repository(object):
             except IOError:
                 pass
 
-            self.push_paper(paper, event=False)
-            # remove_paper of old_citekey
-            self.remove_paper(old_citekey, event=False)
-            # send event
-            events.RenameEvent(paper, old_citekey).send()
+            with self.batch():
+                self.push_paper(paper, event=False)
+                # remove_paper of old_citekey
+                self.remove_paper(old_citekey, event=False)
+                # send event
+                self._send(events.RenameEvent(paper, old_citekey))
 
     def push_doc(self, citekey, docfile, copy=None):
         p = self.pull_paper(citekey)
@@ -142,14 +307,20 @@ class Repository(object):
         self.push_paper(p, overwrite=True, event=False)
 
     def unique_citekey(self, base_key):
-        """Create a unique citekey for a given basekey."""
-        for n in itertools.count():
-            if not base_key + _base27(n) in self.citekeys:
-                return base_key + _base27(n)
+        """ Create a unique citekey for a given basekey.
+
+            The smallest free suffix is kept by the citekey index, so that
+            generating keys does not probe the files nor scan the citekeys.
+        """
+        return base_key + _base27(self.citekey_index.free_suffix(base_key))
 
     def get_tags(self):
-        """FIXME: bibdata doesn't need to be read."""
-        tags = set()
-        for p in self.all_papers():
-            tags = tags.union(p.tags)
-        return tags
+        """Return the tags of all the papers, from the index."""
+        return self.index.tags()
+
+    def tagged_papers(self, included=(), excluded=()):
+        """ Return the papers with all the included tags and none of the
+            excluded ones, ordered by citekey. Only those papers are read.
+        """
+        return list(self.pull_papers(
+            sorted(self.index.tagged(included, excluded))))
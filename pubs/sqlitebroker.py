@@ -0,0 +1,189 @@
+import os
+import time
+import sqlite3
+import collections
+import contextlib
+
+from .content import check_directory, check_file, system_path
+
+
+DB_FILE = 'pubs.sqlite'
+MAX_VARIABLES = 500  # stays under the SQLite limit of variables per query
+
+# Mimics the fields of os.stat results used to detect modifications.
+RowStats = collections.namedtuple('RowStats',
+                                  ['st_mtime', 'st_ctime', 'st_size', 'st_ino'])
+
+
+class SQLiteBroker(object):
+    """ Stores the meta and bib files of the repository in a single SQLite
+        database, as an alternative to FileBroker.
+
+        * Provides the same interface as FileBroker.
+        * Does *absolutely no* encoding/decoding.
+        * Communicate failure with exceptions.
+        * The database uses write-ahead logging; writes made inside batch()
+          are grouped in a single transaction.
+    """
+
+    TABLES = ('meta', 'bib')
+    transactional = True  # a failed batch is rolled back
+
+    def __init__(self, directory, create=False):
+        self.directory = directory
+        self.dbpath = os.path.join(self.directory, DB_FILE)
+        if create:
+            self._create()
+        check_directory(self.directory)
+        check_file(self.dbpath)
+        self._db = sqlite3.connect(system_path(self.dbpath), isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._batch_depth = 0
+
+    def _create(self):
+        if not check_directory(self.directory, fail=False):
+            os.mkdir(system_path(self.directory))
+        db = sqlite3.connect(system_path(self.dbpath))
+        with db:
+            for table in self.TABLES:
+                db.execute('CREATE TABLE IF NOT EXISTS {} ('
+                           'citekey TEXT PRIMARY KEY, '
+                           'data TEXT NOT NULL, '
+                           'mtime REAL NOT NULL)'.format(table))
+        db.close()
+
+    def close(self):
+        self._db.close()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Group all the writes done in the block in a single transaction."""
+        if self._batch_depth == 0:
+            self._db.execute('BEGIN')
+        self._batch_depth += 1
+        try:
+            yield
+        except BaseException:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._db.execute('ROLLBACK')
+            raise
+        else:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._db.execute('COMMIT')
+
+    def _pull(self, table, citekey):
+        row = self._db.execute('SELECT data FROM {} WHERE citekey = ?'.format(table),
+                               (citekey,)).fetchone()
+        if row is None:
+            raise IOError(u'{} file does not exist: {}'.format(table, citekey))
+        return row[0]
+
+    def _pull_many(self, table, citekeys):
+        contents = {}
+        for start in range(0, len(citekeys), MAX_VARIABLES):
+            chunk = citekeys[start:start + MAX_VARIABLES]
+            query = 'SELECT citekey, data FROM {} WHERE citekey IN ({})'.format(
+                table, ', '.join('?' * len(chunk)))
+            contents.update(self._db.execute(query, chunk))
+        try:
+            return [contents[citekey] for citekey in citekeys]
+        except KeyError as e:
+            raise IOError(u'{} file does not exist: {}'.format(table, e.args[0]))
+
+    def _stat(self, table, citekey):
+        row = self._db.execute('SELECT mtime, length(data) FROM {} WHERE citekey = ?'.format(table),
+                               (citekey,)).fetchone()
+        if row is None:
+            raise IOError(u'{} file does not exist: {}'.format(table, citekey))
+        return RowStats(row[0], row[0], row[1], None)
+
+    def _push(self, table, citekey, data):
+        self._db.execute('INSERT OR REPLACE INTO {} (citekey, data, mtime) '
+                         'VALUES (?, ?, ?)'.format(table),
+                         (citekey, data, time.time()))
+
+    def pull_metafile(self, citekey):
+        return self._pull('meta', citekey)
+
+    def pull_bibfile(self, citekey):
+        return self._pull('bib', citekey)
+
+    def pull_metafiles(self, citekeys):
+        """Return the content of several metafiles, in the order of citekeys."""
+        return self._pull_many('meta', list(citekeys))
+
+    def pull_bibfiles(self, citekeys):
+        """Return the content of several bibfiles, in the order of citekeys."""
+        return self._pull_many('bib', list(citekeys))
+
+    def stat_metafile(self, citekey):
+        return self._stat('meta', citekey)
+
+    def stat_bibfile(self, citekey):
+        return self._stat('bib', citekey)
+
+    def push_metafile(self, citekey, metadata):
+        """Put content to disk. Will gladly override anything standing in its way."""
+        self._push('meta', citekey, metadata)
+
+    def push_bibfile(self, citekey, bibdata):
+        """Put content to disk. Will gladly override anything standing in its way."""
+        self._push('bib', citekey, bibdata)
+
+    def push(self, citekey, metadata, bibdata):
+        """Put content to disk. Will gladly override anything standing in its way."""
+        with self.batch():
+            self.push_metafile(citekey, metadata)
+            self.push_bibfile(citekey, bibdata)
+
+    def remove(self, citekey):
+        with self.batch():
+            for table in self.TABLES:
+                self._db.execute('DELETE FROM {} WHERE citekey = ?'.format(table),
+                                 (citekey,))
+
+    def exists(self, citekey, meta_check=False):
+        """ Checks wether the bibtex of a citekey exists.
+
+            :param meta_check:  if True, will return if both the bibtex and the meta file exists.
+        """
+        tables = self.TABLES if meta_check else ('bib',)
+        for table in tables:
+            row = self._db.execute('SELECT 1 FROM {} WHERE citekey = ?'.format(table),
+                                   (citekey,)).fetchone()
+            if row is None:
+                return False
+        return True
+
+    def citekeys(self):
+        return [row[0] for row in self._db.execute('SELECT citekey FROM bib')]
+
+    def citekeys_stamp(self):
+        """Always None: the citekeys are listed by a single query instead."""
+        return None
+
+    def listing(self, filestats=True):
+        """ List the citekeys of the meta and bib files.
+
+            :param filestats:  if True, the stats of the files are provided
+                               in 'metastats' and 'bibstats', as lists
+                               parallel to the 'metafiles' and 'bibfiles'
+                               lists of citekeys.
+        """
+        listing = {}
+        for table in self.TABLES:
+            if filestats:
+                rows = self._db.execute('SELECT citekey, mtime, length(data) FROM {}'.format(table))
+                citekeys, stats = [], []
+                for citekey, mtime, size in rows:
+                    citekeys.append(citekey)
+                    stats.append(RowStats(mtime, mtime, size, None))
+                listing[table + 'stats'] = stats
+            else:
+                citekeys = [row[0] for row in
+                            self._db.execute('SELECT citekey FROM {}'.format(table))]
+            listing[table + 'files'] = citekeys
+        return listing
@@ -22,8 +22,7 @@ def resolve_citekey(repo, citekey, ui=None, exit_on_fail=True):
             citekeys = sorted(citekeys)
             ui.error("be more specific; provided citekey '{}' matches multiples citekeys:".format(
                      citekey))
-            for c in citekeys:
-                p = repo.pull_paper(c)
+            for p in repo.pull_paper_summaries(citekeys):
                 ui.message(u'    {}'.format(pretty.paper_oneliner(p)))
             if exit_on_fail:
                 ui.exit()
@@ -0,0 +1,49 @@
+"""Benchmark the encoding of bibtex entries, as done by pubs export.
+
+Run with: python tests/bench_endecoder.py
+Exits with an error if the throughput is under TARGET_THROUGHPUT.
+"""
+from __future__ import print_function
+
+import io
+import sys
+import timeit
+
+import dotdot
+from pubs import endecoder
+
+import fixtures
+
+
+N_ENTRIES = 100000
+TARGET_THROUGHPUT = 50000  # entries per second
+
+
+def bibentries(n=N_ENTRIES):
+    """Variations of the fixture entries, some with long abstracts."""
+    templates = [fixtures.page_bibdata, fixtures.turing_bibdata,
+                 fixtures.doe_bibdata]
+    for i in range(n):
+        bibdata = dict(templates[i % len(templates)])
+        if i % 10 == 0:
+            bibdata['abstract'] = 'A long abstract. ' * 200
+        yield 'Key{}'.format(i), bibdata
+
+
+def export(entries):
+    coder = endecoder.EnDecoder()
+    output = io.StringIO()
+    for citekey, bibdata in entries:
+        output.write(coder.encode_bibdata({citekey: bibdata}))
+        output.write(u'\n')
+    return output
+
+
+if __name__ == '__main__':
+    entries = list(bibentries())
+    duration = min(timeit.repeat(lambda: export(entries), number=1, repeat=3))
+    throughput = len(entries) / duration
+    print('exported {} entries in {:.3f}s: {:.0f} entries/s (target: {})'.format(
+          len(entries), duration, throughput, TARGET_THROUGHPUT))
+    if throughput < TARGET_THROUGHPUT:
+        sys.exit(1)
@@ -0,0 +1,45 @@
+"""Benchmark the cleaning of the metadata of papers.
+
+Run with: python tests/bench_metadata.py
+"""
+from __future__ import print_function
+
+import timeit
+from datetime import datetime, timedelta
+
+import dotdot
+from pubs import paper
+
+from dateutil.parser import parse as datetime_parse
+
+
+N_METADATA = 50000
+
+
+def metadata_dicts(n=N_METADATA):
+    start = datetime(2010, 1, 1, 8, 30, 0, 123456)
+    return [{'docfile': 'docsdir://paper{}.pdf'.format(i),
+             'tags': ['tag{}'.format(i % 10)],
+             'added': str(start + timedelta(minutes=17 * i))}
+            for i in range(n)]
+
+
+def clean_with_dateutil(metadata):
+    meta = paper._clean_metadata(dict(metadata, added=None))
+    meta['added'] = datetime_parse(metadata['added'])
+    return meta
+
+
+def bench(fun, metadata, repeat=3):
+    return min(timeit.repeat(lambda: [fun(m) for m in metadata],
+                             number=1, repeat=repeat))
+
+
+if __name__ == '__main__':
+    metadata = metadata_dicts()
+    assert ([paper._clean_metadata(m) for m in metadata] ==
+            [clean_with_dateutil(m) for m in metadata])
+    print('cleaning {} metadata dicts:'.format(len(metadata)))
+    for name, fun in [('dateutil', clean_with_dateutil),
+                      ('fast path', paper._clean_metadata)]:
+        print('    {:<10} {:.3f}s'.format(name, bench(fun, metadata)))
@@ -81,6 +81,28 @@ class UnicodeStringIOWrapper(object):
         return self._strio.__exit__(*args)
 
 
+class ByteStringIOWrapper(UnicodeStringIOWrapper):
+    """Same hack for binary files: fake_filesystem stores file contents as
+    str and cannot hold arbitrary bytes under python 3, so they are stored
+    as latin-1 characters.
+    """
+
+    def read(self, *args):
+        return self._strio.read(*args).encode('latin-1')
+
+    def readline(self, *args):
+        return self._strio.readline(*args).encode('latin-1')
+
+    def readlines(self, *args):
+        return [l.encode('latin-1') for l in self._strio.readlines(*args)]
+
+    def write(self, data):
+        self._strio.write(data.decode('latin-1'))
+
+    def writelines(self, data):
+        self._strio.write([l.decode('latin-1') for l in data])
+
+
 def _force_binary_mode(mode):
     if 'b' in mode:
         return mode # python 2 fix.
@@ -94,6 +116,16 @@ class FakeIO(object):
         self.fake_open = fake_open
 
     def open(self, *args, **kwargs):
+        mode = args[1] if len(args) > 1 else kwargs.get('mode', 'r')
+        if 'b' in mode and sys.version_info[0] > 2:
+            # Opens in text mode, bytes are mapped to latin-1 characters
+            args = list(args)
+            if len(args) > 1:
+                args[1] = mode.replace('b', '')
+            else:
+                kwargs['mode'] = mode.replace('b', '')
+            kwargs['newline'] = ''
+            return ByteStringIOWrapper(self.fake_open.Call(*args, **kwargs))
         # Forces binary mode for FakeFileOpen
         args = list(args)
         if len(args) > 1:
@@ -104,6 +136,12 @@ class FakeIO(object):
         return UnicodeStringIOWrapper(fakefs_stringio)
 
 
+def _fake_fd(fake_os, path):
+    if not fake_os.path.exists(path):
+        raise OSError(2, 'No such file or directory', path)
+    return -1
+
+
 def create_fake_fs(module_list):
 
     fake_fs = fake_filesystem.FakeFilesystem()
@@ -114,6 +152,16 @@ def create_fake_fs(module_list):
     fake_io = FakeIO(fake_open)
 
     fake_fs.CreateDirectory(fake_os.path.expanduser('~'))
+    # fake_filesystem does not provide scandir, which would otherwise be
+    # forwarded to the real os module.
+    fake_os.scandir = lambda path: [content._DirEntry(path, name)
+                                    for name in fake_os.listdir(path)]
+    # nor os.replace; its os.open only creates files, and syncing files
+    # to disk is meaningless in memory.
+    fake_os.replace = fake_os.rename
+    fake_os.open = lambda path, flags, mode=None: _fake_fd(fake_os, path)
+    fake_os.fsync = lambda fd: None
+    fake_os.close = lambda fd: None
 
     sys.modules['os']     = fake_os
     sys.modules['shutil'] = fake_shutil
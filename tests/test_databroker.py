@@ -8,6 +8,7 @@ import fake_env
 from pubs import content, filebroker, databroker, datacache, configs
 
 import str_fixtures
+import fixtures
 from pubs import endecoder
 
 
@@ -73,5 +74,125 @@ class TestDataBroker(unittest.TestCase):
             fake_env.unset_fake_fs([content, filebroker])
 
 
+class TestDataCacheSnapshot(fake_env.TestFakeFs):
+
+    def setUp(self):
+        super(TestDataCacheSnapshot, self).setUp()
+        fake_env.copy_dir(self.fs, os.path.join(os.path.dirname(__file__), 'testrepo'), 'repo')
+        for filename in ['bib/Page99.bib', 'meta/Page99.yaml']:
+            self.backdate('repo/' + filename)
+
+    def backdate(self, path):
+        fake_file = self.fs['fs'].GetObject(path)
+        fake_file.st_mtime = fake_file.st_ctime = 0
+
+    def count_decodes(self, db):
+        db.decoded = []
+        decode_many_bibdata = db.databroker.endecoder.decode_many_bibdata
+        def counting_decode(bibdata_raws):
+            db.decoded.extend(bibdata_raws)
+            return decode_many_bibdata(bibdata_raws)
+        db.databroker.endecoder.decode_many_bibdata = counting_decode
+
+    def test_snapshot_is_used(self):
+        db = datacache.DataCache('repo')
+        pulled = list(db.pull_many(['Page99']))
+        db.save_snapshot()
+        self.assertTrue(content.check_file(db.snapshot_path, fail=False))
+
+        db = datacache.DataCache('repo')
+        self.count_decodes(db)
+        self.assertEqual(list(db.pull_many(['Page99'])), pulled)
+        self.assertEqual(db.pull_bibentry('Page99'), pulled[0][1])
+        self.assertEqual(db.pull_metadata('Page99'), pulled[0][2])
+        self.assertEqual(db.decoded, [])
+
+    def test_single_pull_does_not_load_snapshot(self):
+        db = datacache.DataCache('repo')
+        list(db.pull_many(['Page99']))
+        db.save_snapshot()
+        db = datacache.DataCache('repo')
+        db.pull_bibentry('Page99')
+        db.pull_metadata('Page99')
+        self.assertIsNone(db._snapshot)
+
+    def test_pulled_data_is_a_copy(self):
+        db = datacache.DataCache('repo')
+        db.pull_bibentry('Page99')['Page99']['year'] = '2042'
+        self.assertEqual(db.pull_bibentry('Page99')['Page99']['year'], '1999')
+
+    def test_modified_file_is_decoded(self):
+        db = datacache.DataCache('repo')
+        list(db.pull_many(['Page99']))
+        db.save_snapshot()
+
+        bibraw = content.read_file('repo/bib/Page99.bib')
+        content.write_file('repo/bib/Page99.bib', bibraw.replace('1999', '2007'))
+        db = datacache.DataCache('repo')
+        self.count_decodes(db)
+        bibentry = list(db.pull_many(['Page99']))[0][1]
+        self.assertEqual(bibentry['Page99']['year'], '2007')
+        self.assertEqual(len(db.decoded), 1)
+
+    def test_recent_file_is_not_cached(self):
+        db = datacache.DataCache('repo')
+        list(db.pull_many(['journal0063400']))
+        self.assertNotIn('journal0063400', db.snapshot['bib'])
+        list(db.pull_many(['Page99']))
+        self.assertIn('Page99', db.snapshot['bib'])
+
+    def test_removed_files_are_pruned(self):
+        db = datacache.DataCache('repo')
+        list(db.pull_many(['Page99']))
+        db.remove('Page99')
+        db._snapshot['bib']['Larry99'] = db._snapshot['bib']['Page99'] = None
+        list(db.pull_many())
+        self.assertNotIn('Page99', db.snapshot['bib'])
+        self.assertNotIn('Larry99', db.snapshot['bib'])
+
+    def test_corrupted_snapshot_is_ignored(self):
+        content.write_file('repo/.cache', 'garbage')
+        db = datacache.DataCache('repo')
+        self.assertEqual(list(db.pull_many(['Page99']))[0][1],
+                         databroker.DataBroker('repo').pull_bibentry('Page99'))
+
+
+class TestChangeTracker(fake_env.TestFakeFs):
+
+    def setUp(self):
+        super(TestChangeTracker, self).setUp()
+        fake_env.copy_dir(self.fs, os.path.join(os.path.dirname(__file__), 'testrepo'), 'repo')
+        for path in self.fs['glob'].glob('repo/*/*'):
+            fake_file = self.fs['fs'].GetObject(path)
+            fake_file.st_mtime = fake_file.st_ctime = 0
+        self.db = datacache.DataCache('repo')
+        self.tracker = datacache.ChangeTracker(self.db.databroker)
+
+    def test_first_scan_adds_everything(self):
+        added, modified, removed = self.tracker.changes()
+        self.assertEqual(added, {'Page99', '10.1371_journal.pone.0038236',
+                                 '10.1371journal.pone.0063400', 'journal0063400'})
+        self.assertEqual(modified, set())
+        self.assertEqual(removed, set())
+        self.assertEqual(self.tracker.changes(), (set(), set(), set()))
+
+    def test_changes(self):
+        self.tracker.changes()
+        self.db.push_metadata('Page99', {'tags': ['search']})
+        self.db.remove('journal0063400')
+        self.db.push_metadata('Larry99', {})
+        self.db.push_bibentry('Larry99', fixtures.doe_bibentry)
+        added, modified, removed = self.tracker.changes()
+        self.assertEqual(added, {'Larry99'})
+        self.assertEqual(modified, {'Page99'})
+        self.assertEqual(removed, {'journal0063400'})
+
+    def test_manifest_can_be_restored(self):
+        self.tracker.changes()
+        tracker = datacache.ChangeTracker(self.db.databroker,
+                                          dict(self.tracker.manifest))
+        self.assertEqual(tracker.changes(), (set(), set(), set()))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
+import os
+import io
+import glob
 import unittest
+from datetime import datetime
 
 import yaml
 
 import dotdot
 from pubs import endecoder
 from pubs.p3 import ustr
+from pubs.bibstruct import str2citekey
 
 from fixtures import dummy_metadata
 from str_fixtures import bibtex_raw0, metadata_raw0, turing_bib
@@ -98,6 +103,228 @@ class TestEnDecode(unittest.TestCase):
         metadata_output0 = decoder.encode_metadata(entry)
         self.assertEqual(set(metadata_raw0.split('\n')), set(metadata_output0.split('\n')))
 
+    def test_metadata_same_with_and_without_libyaml(self):
+        if not hasattr(yaml, 'CSafeDumper'):
+            self.skipTest('libyaml bindings are not available')
+        metadata = dict(dummy_metadata)
+        metadata.update({'docfile': u'docsdir://Page99 é.pdf',
+                         'tags': set([u'search', u'nétwork']),
+                         'added': datetime(2013, 12, 12, 12, 12, 12, 12)})
+        raws = []
+        default_dumper = endecoder.SafeDumper
+        for dumper in (yaml.SafeDumper, yaml.CSafeDumper):
+            endecoder.SafeDumper = dumper
+            try:
+                raws.append(endecoder.EnDecoder().encode_metadata(metadata))
+            finally:
+                endecoder.SafeDumper = default_dumper
+        self.assertEqual(raws[0].encode('utf-8'), raws[1].encode('utf-8'))
+        self.assertEqual(yaml.load(raws[0], Loader=yaml.SafeLoader),
+                         yaml.load(raws[0], Loader=yaml.CSafeLoader))
+        self.assertEqual(endecoder.EnDecoder().decode_metadata(raws[0]), metadata)
+
+    def test_endecode_json_metadata(self):
+        metadata = {'docfile': u'docsdir://Page99 é.pdf',
+                    'tags': set([u'search', u'nétwork']),
+                    'added': datetime(2013, 12, 12, 12, 12, 12, 12)}
+        decoder = endecoder.EnDecoder(metadata_format='json')
+        metadata_raw = decoder.encode_metadata(metadata)
+        self.assertTrue(metadata_raw.startswith('{'))
+        self.assertEqual(decoder.decode_metadata(metadata_raw), metadata)
+        # both formats are read by any encoder
+        self.assertEqual(endecoder.EnDecoder().decode_metadata(metadata_raw),
+                         metadata)
+        self.assertEqual(decoder.decode_metadata(metadata_raw0),
+                         endecoder.EnDecoder().decode_metadata(metadata_raw0))
+
+    def test_decode_many_mixed_metadata(self):
+        yaml_decoder = endecoder.EnDecoder()
+        json_decoder = endecoder.EnDecoder(metadata_format='json')
+        raws = [metadata_raw0,
+                json_decoder.encode_metadata(dummy_metadata),
+                yaml_decoder.encode_metadata(dummy_metadata)]
+        self.assertEqual(yaml_decoder.decode_many_metadata(raws),
+                         [yaml_decoder.decode_metadata(metadata_raw0),
+                          dummy_metadata, dummy_metadata])
+
+    def test_decode_many_metadata(self):
+        decoder = endecoder.EnDecoder()
+        raws = [metadata_raw0, decoder.encode_metadata(dummy_metadata)]
+        self.assertEqual(decoder.decode_many_metadata(raws),
+                         [decoder.decode_metadata(raw) for raw in raws])
+
+    def test_decode_many_bibdata(self):
+        decoder = endecoder.EnDecoder()
+        raws = [bibtex_raw0, turing_bib, bibtex_raw0]
+        self.assertEqual(decoder.decode_many_bibdata(raws),
+                         [decoder.decode_bibdata(raw) for raw in raws])
+
+
+class TestIterBibdata(unittest.TestCase):
+
+    def test_iter_entries(self):
+        decoder = endecoder.EnDecoder()
+        lines = io.StringIO(turing_bib + '\n' + bibtex_raw0)
+        entries = list(decoder.iter_bibdata(lines))
+        self.assertEqual([citekey for citekey, _ in entries],
+                         ['turing1950computing', 'Page99'])
+        self.assertEqual(dict(entries), dict(decoder.decode_bibdata(turing_bib),
+                                             **decoder.decode_bibdata(bibtex_raw0)))
+
+    def test_malformed_entries_reported_individually(self):
+        decoder = endecoder.EnDecoder()
+        bib = (u'@article{\n}\n' + turing_bib
+               + u'@misc{broken,\n    title = {Unclosed,\n')
+        entries = list(decoder.iter_bibdata(io.StringIO(bib)))
+        self.assertEqual(len(entries), 3)
+        citekey, error = entries[0]
+        self.assertIsNone(citekey)
+        self.assertIsInstance(error, endecoder.MalformedEntry)
+        self.assertEqual(error.lineno, 1)
+        self.assertEqual(entries[1], list(decoder.decode_bibdata(turing_bib).items())[0])
+        self.assertEqual(entries[2][0], 'broken')
+        self.assertIsInstance(entries[2][1], endecoder.MalformedEntry)
+
+    def test_strings_and_comments(self):
+        decoder = endecoder.EnDecoder()
+        bib = (u'@comment{nothing to see}\n'
+               u'@string{mind = "Mind"}\n'
+               + turing_bib.replace('journal={Mind}', 'journal=mind'))
+        entries = list(decoder.iter_bibdata(io.StringIO(bib)))
+        self.assertEqual(entries, list(decoder.decode_bibdata(turing_bib).items()))
+
+    def test_strings_same_as_bibtexparser(self):
+        decoder = endecoder.EnDecoder()
+        bib = (u'@string{j-mind = "Mind"}\n'
+               + turing_bib.replace('journal={Mind}', 'journal=J-Mind')
+               + u'@string{pub = "Addison"}\n'
+               u'@string{pubs = pub # " Wesley"}\n'
+               + bibtex_raw0.replace('publisher = "Stanford InfoLab"',
+                                     'publisher = pubs'))
+        entries = list(decoder.iter_bibdata(io.StringIO(bib)))
+        self.assertEqual(dict(entries), decoder._parse_bibdata(bib))
+        self.assertEqual(entries[1][1]['publisher'], 'Addison Wesley')
+
+
+class TestDecodeCache(unittest.TestCase):
+
+    def test_counts_hits_and_misses(self):
+        decoder = endecoder.EnDecoder(cache_size=2)
+        decoded = decoder.decode_bibdata(bibtex_raw0)
+        self.assertEqual(decoder.decode_bibdata(bibtex_raw0), decoded)
+        decoder.decode_metadata(metadata_raw0)
+        self.assertEqual((decoder.cache_hits, decoder.cache_misses), (1, 2))
+
+    def test_returns_copies(self):
+        decoder = endecoder.EnDecoder(cache_size=2)
+        decoder.decode_metadata(metadata_raw0)['tags'].append('modified')
+        metadata = decoder.decode_metadata(metadata_raw0)
+        self.assertNotIn('modified', metadata['tags'])
+        metadata['tags'].append('modified')
+        self.assertNotIn('modified', decoder.decode_metadata(metadata_raw0)['tags'])
+        self.assertEqual(decoder.cache_hits, 2)
+
+    def test_least_recently_used_evicted(self):
+        decoder = endecoder.EnDecoder(cache_size=2)
+        decoder.decode_bibdata(bibtex_raw0)
+        decoder.decode_bibdata(turing_bib)
+        decoder.decode_bibdata(bibtex_raw0)
+        decoder.decode_metadata(metadata_raw0)  # evicts turing_bib
+        decoder.decode_bibdata(bibtex_raw0)
+        decoder.decode_bibdata(turing_bib)
+        self.assertEqual((decoder.cache_hits, decoder.cache_misses), (2, 4))
+
+    def test_disabled_by_default(self):
+        decoder = endecoder.EnDecoder()
+        decoder.decode_bibdata(bibtex_raw0)
+        decoder.decode_bibdata(bibtex_raw0)
+        self.assertEqual((decoder.cache_hits, decoder.cache_misses), (0, 0))
+
+
+class TestCanonicalReader(unittest.TestCase):
+
+    def bib_corpus(self):
+        tests_dir = os.path.dirname(__file__)
+        paths = []
+        for directory in ('bibexamples', 'data', os.path.join('testrepo', 'bib')):
+            paths.extend(glob.glob(os.path.join(tests_dir, directory, '*.bib')))
+        raws = [io.open(path, encoding='utf-8').read() for path in sorted(paths)]
+        self.assertTrue(len(raws) > 0)
+        return raws + [bibtex_raw0, turing_bib]
+
+    def test_same_as_bibtexparser(self):
+        decoder = endecoder.EnDecoder()
+        for raw in self.bib_corpus():
+            self.assertEqual(decoder.decode_bibdata(raw),
+                             decoder._parse_bibdata(raw))
+
+    def test_encoded_bibdata_read_as_bibtexparser(self):
+        decoder = endecoder.EnDecoder()
+        for raw in self.bib_corpus():
+            bibentry = decoder._parse_bibdata(raw)
+            citekey = list(bibentry.keys())[0]
+            if ustr(citekey) != str2citekey(citekey):
+                continue  # entries without a valid citekey
+            encoded = decoder.encode_bibdata(bibentry)
+            record = endecoder._read_canonical_entry(encoded)
+            self.assertIsNotNone(record)
+            self.assertEqual(dict([decoder._entry_from_record(record)]),
+                             decoder._parse_bibdata(encoded))
+
+    def test_fallback_on_deviating_bibdata(self):
+        decoder = endecoder.EnDecoder()
+        encoded = decoder.encode_bibdata(decoder.decode_bibdata(turing_bib))
+        deviations = [
+            encoded.replace('},\n}', '}\n}'),               # no last comma
+            encoded.replace('    title = {', '    title = {{'),  # unbalanced
+            encoded.replace('year = {1950}', 'year = 1950'),
+            encoded + encoded.replace('turing1950computing', 'turing1950'),
+            '% comment\n' + encoded,
+            encoded.replace('\n', '\r\n'),
+            ]
+        for raw in deviations:
+            self.assertIsNone(endecoder._read_canonical_entry(raw))
+            try:
+                expected = decoder._parse_bibdata(raw)
+            except ValueError:
+                with self.assertRaises(ValueError):
+                    decoder.decode_bibdata(raw)
+            else:
+                self.assertEqual(decoder.decode_bibdata(raw), expected)
+
+
+class TestDecodingPool(unittest.TestCase):
+
+    def setUp(self):
+        self.decoder = endecoder.EnDecoder()
+        self.pool = endecoder.DecodingPool(2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_decode_many_bibdata_keeps_order(self):
+        raws = [bibtex_raw0.replace('1999', str(year))
+                for year in range(1900, 1900 + 3 * endecoder.CHUNK_SIZE)]
+        self.assertEqual(self.pool.decode_many_bibdata(raws),
+                         self.decoder.decode_many_bibdata(raws))
+
+    def test_decode_many_metadata_keeps_order(self):
+        raws = [metadata_raw0.replace('search', 'search{}'.format(i))
+                for i in range(3 * endecoder.CHUNK_SIZE)]
+        self.assertEqual(self.pool.decode_many_metadata(raws),
+                         self.decoder.decode_many_metadata(raws))
+
+    def test_iter_bibdata_keeps_order(self):
+        raws = [bibtex_raw0.replace('Page99', 'Page{}'.format(i))
+                for i in range(5 * endecoder.CHUNK_SIZE)]
+        lines = io.StringIO(''.join(raws))
+        self.assertEqual(list(self.pool.iter_bibdata(lines)),
+                         list(self.decoder.iter_bibdata(io.StringIO(''.join(raws)))))
+
+    def test_pool_started_lazily(self):
+        self.pool.decode_many_metadata([metadata_raw0])
+        self.assertIsNone(self.pool._pool)
+
 
 if __name__ == '__main__':
     unittest.main()
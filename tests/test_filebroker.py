@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import unittest
 import os
+import shutil
+import tempfile
 
 import dotdot
 import fake_env
@@ -79,6 +81,123 @@ class TestFileBroker(fake_env.TestFakeFs):
             self.assertEqual(fb.pull_metafile('citekey1'), 'defg')
         self.assertFalse(fb.exists('citekey1'))
 
+    def test_listing(self):
+
+        fake_env.copy_dir(self.fs, os.path.join(os.path.dirname(__file__), 'testrepo'), 'testrepo')
+        fb = filebroker.FileBroker('testrepo')
+        fb.push_metafile('Larry99', 'abc')
+
+        citekeys = {'Page99', '10.1371_journal.pone.0038236',
+                    '10.1371journal.pone.0063400', 'journal0063400'}
+        listing = fb.listing(filestats=False)
+        self.assertEqual(set(listing['bibfiles']), citekeys)
+        self.assertEqual(set(listing['metafiles']), citekeys | {'Larry99'})
+
+        self.assertEqual(set(fb.citekeys()), citekeys)
+
+        listing = fb.listing(filestats=True)
+        self.assertEqual(set(listing['bibfiles']), citekeys)
+        self.assertEqual(len(listing['metafiles']), len(listing['metastats']))
+        for citekey, stats in zip(listing['metafiles'], listing['metastats']):
+            self.assertEqual(stats.st_size,
+                             len(fb.pull_metafile(citekey).encode('utf-8')))
+
+    def test_listing_ignores_other_files(self):
+        fb = filebroker.FileBroker('testrepo', create=True)
+        fb.push_bibfile('citekey1', 'abc')
+        content.write_file('testrepo/bib/.bib', 'abc')
+        content.write_file('testrepo/bib/citekey2.bib~', 'abc')
+        content.write_file('testrepo/bib/citekey3.yaml', 'abc')
+        self.assertEqual(fb.listing(filestats=False)['bibfiles'], ['citekey1'])
+
+
+    def test_batch(self):
+        fb = filebroker.FileBroker('testrepo', create=True)
+        fb.push('citekey1', 'abc', 'def')
+        with fb.batch():
+            fb.push_bibfile('citekey2', 'ghi')
+            with fb.batch():
+                fb.push('citekey1', 'jkl', 'mno')
+            fb.remove('citekey2')
+            self.assertEqual(fb.pull_metafile('citekey1'), 'jkl')
+            self.assertFalse(fb.exists('citekey2'))
+        self.assertIsNone(fb._written)
+        self.assertEqual(fb.pull_bibfile('citekey1'), 'mno')
+        self.assertEqual(sorted(self.fs['os'].listdir('testrepo/bib')),
+                         ['citekey1.bib'])
+
+
+class TestAtomicWrite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_replace_and_sync(self):
+        path = os.path.join(self.tmpdir, 'file.bib')
+        content.write_file(path, u'abc')
+        content.write_file(path, u'déf', sync=False)
+        self.assertEqual(content.read_file(path), u'déf')
+        self.assertEqual(os.listdir(self.tmpdir), ['file.bib'])
+        synced = []
+        fsync_path = content._fsync_path
+        content._fsync_path = synced.append
+        try:
+            content.sync_files([path, os.path.join(self.tmpdir, 'removed.bib')])
+        finally:
+            content._fsync_path = fsync_path
+        # the written file first, then its directory once
+        self.assertEqual(synced, [path, self.tmpdir])
+        content.sync_files([path])
+
+    def test_failed_write_keeps_file(self):
+        path = os.path.join(self.tmpdir, 'file.bib')
+        content.write_file(path, u'abc')
+        with self.assertRaises(TypeError):
+            content.write_file(path, object())
+        self.assertEqual(content.read_file(path), u'abc')
+        self.assertEqual(os.listdir(self.tmpdir), ['file.bib'])
+
+
+class TestShardedFileBroker(fake_env.TestFakeFs):
+
+    def test_pushpull(self):
+        fb = filebroker.FileBroker('bla', create=True, sharded=True)
+        fb.push_metafile('citekey1', 'abc')
+        fb.push_bibfile('citekey1', 'cdef')
+        shard = filebroker.shard('citekey1')
+        self.assertEqual(self.fs['os'].listdir('bla/bib'), [shard])
+        self.assertTrue(content.check_file('bla/bib/{}/citekey1.bib'.format(shard), fail=False))
+
+        self.assertEqual(fb.pull_metafile('citekey1'), 'abc')
+        self.assertEqual(fb.pull_bibfile('citekey1'), 'cdef')
+        self.assertTrue(fb.exists('citekey1', meta_check=True))
+        self.assertEqual(fb.listing(filestats=False),
+                         {'metafiles': ['citekey1'], 'bibfiles': ['citekey1']})
+
+        fb.remove('citekey1')
+        self.assertFalse(fb.exists('citekey1'))
+
+    def test_convert(self):
+        fake_env.copy_dir(self.fs, os.path.join(os.path.dirname(__file__), 'testrepo'), 'testrepo')
+        fb = filebroker.FileBroker('testrepo')
+        citekeys = set(fb.citekeys())
+        bibraw = fb.pull_bibfile('Page99')
+
+        fb.convert_layout(sharded=True)
+        self.assertTrue(fb.sharded)
+        self.assertEqual(content.check_file('testrepo/bib/Page99.bib', fail=False), False)
+        self.assertEqual(set(fb.citekeys()), citekeys)
+        self.assertEqual(set(fb.listing(filestats=False)['metafiles']), citekeys)
+        self.assertEqual(fb.pull_bibfile('Page99'), bibraw)
+
+        fb.convert_layout(sharded=False)
+        self.assertEqual(set(self.fs['os'].listdir('testrepo/bib')),
+                         set(c + '.bib' for c in citekeys))
+        self.assertEqual(fb.pull_bibfile('Page99'), bibraw)
+
 
 class TestDocBroker(fake_env.TestFakeFs):
 
@@ -0,0 +1,159 @@
+import unittest
+
+import dotdot
+import fake_env
+import fixtures
+
+from pubs.repo import Repository
+from pubs.paper import Paper
+from pubs.index import Index, CitekeyIndex, Summaries, paper_terms
+from pubs.commands.list_cmd import parse_query
+from pubs import configs, content, pretty
+
+
+class TestPaperTerms(unittest.TestCase):
+
+    def test_terms(self):
+        terms = paper_terms(fixtures.doe_bibentry['Doe2013'],
+                            {'tags': ['Math', 'b']})
+        self.assertEqual(terms['author'], {'doe'})
+        self.assertEqual(terms['title'], {'nice', 'title'})
+        self.assertEqual(terms['tag'], {'math', 'b'})
+        self.assertEqual(terms['year'], {'2013'})
+        self.assertEqual(terms['type'], {'article'})
+
+
+class TestIndex(fake_env.TestFakeFs):
+
+    def setUp(self):
+        super(TestIndex, self).setUp()
+        self.repo = Repository(configs.Config(), create=True)
+        self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry))
+        self.repo.push_paper(Paper.from_bibentry(fixtures.page_bibentry))
+        self.repo.push_paper(Paper.from_bibentry(
+            fixtures.turing_bibentry, metadata=fixtures.turing_metadata))
+
+    def reloaded(self):
+        return Index(self.repo.databroker)
+
+    def test_built_and_saved(self):
+        index = self.repo.index
+        self.assertEqual(index.citekeys(), self.repo.citekeys)
+        self.assertTrue(content.check_file(index.path, fail=False))
+        self.assertEqual(self.reloaded().lookup('author', 'doe'), {'Doe2013'})
+
+    def test_search(self):
+        index = self.repo.index
+        self.assertEqual(index.search('author', 'Tur'), {'turing1950computing'})
+        self.assertEqual(index.search('title', 'nice ti'), {'Doe2013'})
+        self.assertEqual(index.search('tag', 'AI'), {'turing1950computing'})
+        self.assertEqual(index.search_years(1950, 2000),
+                         {'Page99', 'turing1950computing'})
+
+    def test_tags(self):
+        self.repo.push_paper(Paper.from_bibentry(
+            fixtures.franny_bibentry, metadata={'tags': ['ai', 'fiction']}))
+        index = self.repo.index
+        self.assertEqual(index.tags(), {'AI', 'computer', 'ai', 'fiction'})
+        self.assertEqual(self.repo.get_tags(), index.tags())
+        self.assertEqual(index.tagged(['AI']), {'turing1950computing'})
+        self.assertEqual(index.tagged(excluded=['ai']),
+                         {'Doe2013', 'Page99', 'turing1950computing'})
+        paper = self.repo.pull_paper('Page99')
+        paper.add_tag('fiction')
+        self.repo.push_paper(paper, overwrite=True)
+        self.assertEqual([p.citekey for p in
+                          self.repo.tagged_papers(['fiction'], ['AI'])],
+                         ['Franny1961', 'Page99'])
+
+    def test_citekeys_from_prefix(self):
+        self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry,
+                                                 citekey='Doe2013a'))
+        index = self.repo.citekey_index
+        self.assertEqual(index.citekeys_from_prefix('Doe'),
+                         ['Doe2013', 'Doe2013a'])
+        self.assertEqual(index.citekeys_from_prefix('Doe2013a'), ['Doe2013a'])
+        self.assertEqual(index.citekeys_from_prefix('Doz'), [])
+        self.assertEqual(index.citekeys_from_prefix(''),
+                         sorted(self.repo.citekeys))
+        self.repo.remove_paper('Doe2013')
+        self.assertEqual(self.repo.citekeys_from_prefix('Do'), ('Doe2013a',))
+        self.assertEqual(CitekeyIndex(self.repo.databroker).citekeys_from_prefix('Do'),
+                         ['Doe2013a'])
+
+    def test_citekeys_kept_apart_from_the_index(self):
+        repo = Repository(configs.Config())
+        self.assertEqual(repo.citekeys_from_prefix('Pa'), ('Page99',))
+        self.assertIsNone(repo._index)
+        Repository(configs.Config()).remove_paper('Page99')
+        self.assertEqual(CitekeyIndex(repo.databroker).citekeys_from_prefix('Pa'), [])
+
+    def test_citekeys_listed_only_when_directory_changed(self):
+        bibdir = self.fs['fs'].GetObject(self.repo.databroker.directory + '/bib')
+        bibdir.st_mtime = 0
+        CitekeyIndex(self.repo.databroker).save()
+        datacache = Repository(configs.Config()).databroker
+        datacache.citekeys = None  # not listed again
+        self.assertEqual(CitekeyIndex(datacache).citekeys_from_prefix('Pa'),
+                         ['Page99'])
+        Repository(configs.Config()).remove_paper('Page99')
+        bibdir.st_mtime = 1  # the removal changed the directory
+        datacache = Repository(configs.Config()).databroker
+        self.assertEqual(CitekeyIndex(datacache).citekeys_from_prefix('Pa'), [])
+
+    def test_summary(self):
+        summary = self.repo.pull_paper_summary('turing1950computing')
+        paper = self.repo.pull_paper('turing1950computing')
+        self.assertEqual(pretty.paper_oneliner(summary),
+                         pretty.paper_oneliner(paper))
+
+    def test_summaries_follow_file_changes(self):
+        directory = self.repo.databroker.directory
+        for path in self.fs['glob'].glob(directory + '/*/*'):
+            fake_file = self.fs['fs'].GetObject(path)
+            fake_file.st_mtime = fake_file.st_ctime = 0
+        papers = self.repo.pull_paper_summaries(['Doe2013', 'Page99'])
+        self.assertEqual([p.citekey for p in papers], ['Doe2013', 'Page99'])
+        summaries = Summaries(Repository(configs.Config()).databroker)
+        summaries.datacache.pull_bibentry = None  # files are not read again
+        self.assertEqual(summaries.summary('Page99'),
+                         (papers[1].bibdata, set()))
+        paper = self.repo.pull_paper('Page99')
+        paper.add_tag('search')
+        Repository(configs.Config()).push_paper(paper, overwrite=True)
+        summary = Repository(configs.Config()).pull_paper_summary('Page99')
+        self.assertEqual(summary.tags, {'search'})
+
+    def test_push_remove_rename(self):
+        index = self.repo.index
+        self.repo.push_paper(Paper.from_bibentry(fixtures.franny_bibentry))
+        self.assertEqual(index.lookup('author', 'salinger'), {'Franny1961'})
+        self.repo.remove_paper('Doe2013')
+        self.assertEqual(index.lookup('author', 'doe'), set())
+        paper = self.repo.pull_paper('Page99')
+        self.repo.rename_paper(paper, 'Page1999')
+        self.assertEqual(index.lookup('year', '1999'), {'Page1999'})
+        self.assertEqual(self.reloaded().citekeys(), self.repo.citekeys)
+
+    def test_external_changes(self):
+        self.repo.index
+        repo = Repository(configs.Config())
+        repo.remove_paper('Doe2013')
+        self.assertFalse('Doe2013' in self.reloaded().citekeys())
+
+    def test_candidates_include_matches(self):
+        index = self.repo.index
+        papers = list(self.repo.all_papers())
+        for query in (['author:doe'], ['title:Nice'], ['tag:ai'],
+                      ['year:1950-2000'], ['author:doe', 'or', 'year:1999'],
+                      ['not', 'author:doe'], ['author:doe', 'note:x'],
+                      ['type:book', 'or', 'author:turing']):
+            _, check, candidates = parse_query(query)
+            matching = set(p.citekey for p in papers if check(p))
+            found = candidates(index)
+            if found is not None:
+                self.assertTrue(matching.issubset(found), query)
+
+
+if __name__ == '__main__':
+    unittest.main()
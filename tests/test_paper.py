@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 
 import unittest
+from datetime import datetime
 
 import dotdot
 import fixtures
+from pubs import paper
 from pubs.paper import Paper
 
 
@@ -43,5 +45,49 @@ class TestAttributes(unittest.TestCase):
         self.p.remove_tag('ranking')
 
 
+class TestLazy(unittest.TestCase):
+
+    def test_bibdata_pulled_once_on_access(self):
+        pulled = []
+
+        def pull_bibdata():
+            pulled.append(True)
+            return fixtures.page_bibentry['Page99']
+        p = Paper.lazy('Page99', pull_bibdata, metadata=fixtures.page_metadata)
+        self.assertEqual(p.tags, set(['search', 'network']))
+        self.assertEqual(pulled, [])
+        self.assertEqual(p, Paper.from_bibentry(fixtures.page_bibentry,
+                                                metadata=fixtures.page_metadata))
+        p.bibdata['year']
+        self.assertEqual(pulled, [True])
+
+    def test_set_bibdata(self):
+        p = Paper.lazy('Page99', lambda: self.fail('bibdata pulled'))
+        p.bibdata = {'year': '2000'}
+        self.assertEqual(p.bibdata, {'year': '2000'})
+
+
+class TestAdded(unittest.TestCase):
+
+    def test_added_formats_written_by_pubs(self):
+        added = datetime(2013, 12, 12, 12, 12, 12, 12)
+        for date in (added, added.replace(microsecond=0)):
+            self.assertEqual(paper.parse_added(str(date)), date)
+            self.assertEqual(paper.parse_added(date.isoformat()), date)
+            self.assertEqual(paper._parse_isoformat(str(date)), date)
+            self.assertEqual(paper._parse_isoformat(date.isoformat()), date)
+
+    def test_added_other_format(self):
+        self.assertEqual(paper.parse_added('Dec 12, 2013'),
+                         datetime(2013, 12, 12))
+        with self.assertRaises(ValueError):
+            paper._parse_isoformat('Dec 12, 2013')
+
+    def test_added_string_is_parsed(self):
+        p = Paper.from_bibentry(fixtures.page_bibentry,
+                                metadata={'added': '2013-12-12 12:12:12'})
+        self.assertEqual(p.added, datetime(2013, 12, 12, 12, 12, 12))
+
+
 if __name__ == '__main__':
     unittest.main()
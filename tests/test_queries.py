@@ -5,6 +5,8 @@ from pubs.commands.list_cmd import (_check_author_match,
                                     _check_field_match,
                                     _check_query_block,
                                     filter_paper,
+                                    compile_query,
+                                    _tokenize,
                                     InvalidQuery)
 
 from pubs.paper import Paper
@@ -98,5 +100,75 @@ class TestFilterPaper(unittest.TestCase):
                                       ['author:doee', 'year:2014']))
 
 
+class TestCompiledQuery(unittest.TestCase):
+
+    papers = [doe_paper, page_paper, turing_paper]
+
+    def matching(self, query, **kwargs):
+        check = compile_query(query, **kwargs)
+        return [p.citekey for p in self.papers if check(p)]
+
+    def test_empty(self):
+        self.assertEqual(self.matching([]), ['Doe2013', 'Page99',
+                                             'turing1950computing'])
+
+    def test_or(self):
+        self.assertEqual(self.matching(['author:doe', 'or', 'author:turing']),
+                         ['Doe2013', 'turing1950computing'])
+        self.assertEqual(self.matching(['author:doe', 'OR', 'year:1999']),
+                         ['Doe2013', 'Page99'])
+
+    def test_and(self):
+        self.assertEqual(self.matching(['author:doe', 'and', 'year:2013']),
+                         ['Doe2013'])
+        self.assertEqual(self.matching(['author:doe', 'year:1999']), [])
+
+    def test_not(self):
+        self.assertEqual(self.matching(['not', 'author:doe']),
+                         ['Page99', 'turing1950computing'])
+        self.assertEqual(self.matching(['not', 'not', 'author:doe']),
+                         ['Doe2013'])
+
+    def test_precedence(self):
+        # and binds tighter than or
+        self.assertEqual(self.matching(['author:doe', 'or', 'author:turing',
+                                        'year:1999']),
+                         ['Doe2013'])
+        self.assertEqual(self.matching(['(author:doe', 'or', 'author:turing)',
+                                        'not', 'tag:ai']),
+                         ['Doe2013'])
+        self.assertEqual(self.matching(['(', 'author:page', ')', 'or',
+                                        'not', '(author:doe', 'or',
+                                        'year:1999)']),
+                         ['Page99', 'turing1950computing'])
+
+    def test_year_range(self):
+        self.assertEqual(self.matching(['year:1950-2000']),
+                         ['Page99', 'turing1950computing'])
+        self.assertEqual(self.matching(['year:1999-']), ['Doe2013', 'Page99'])
+        self.assertEqual(self.matching(['year:-1950']), ['turing1950computing'])
+        self.assertEqual(self.matching(['year:201']), ['Doe2013'])
+
+    def test_case(self):
+        self.assertEqual(self.matching(['title:Nice']), ['Doe2013'])
+        self.assertEqual(self.matching(['title:nice'], case_sensitive=True), [])
+        self.assertEqual(self.matching(['title:nIce'], case_sensitive=False),
+                         ['Doe2013'])
+
+    def test_invalid(self):
+        for query in (['title'], ['author:doe', 'or'], ['not'],
+                      ['(author:doe'], ['author:doe)'], ['and', 'author:doe']):
+            with self.assertRaises(InvalidQuery):
+                compile_query(query)
+
+    def test_parentheses_in_values(self):
+        self.assertEqual(_tokenize(['title:Learning (Extended Abstract)']),
+                         ['title:Learning (Extended Abstract)'])
+        self.assertEqual(_tokenize(['(title:(draft))', 'or', 'note:f(x))']),
+                         ['(', 'title:(draft)', ')', 'or', 'note:f(x)', ')'])
+        self.assertEqual(self.matching(['(title:(draft)', 'or',
+                                        'author:doe)']), ['Doe2013'])
+
+
 if __name__ == '__main__':
     unittest.main()
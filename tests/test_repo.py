@@ -5,9 +5,10 @@ import dotdot
 import fake_env
 import fixtures
 
-from pubs.repo import Repository, _base27, CiteKeyCollision, InvalidReference
+from pubs.repo import Repository, CiteKeyCollision, InvalidReference
+from pubs.index import _base27, _base27_value
 from pubs.paper import Paper
-from pubs import configs
+from pubs import configs, events
 
 
 class TestRepo(fake_env.TestFakeFs):
@@ -34,6 +35,124 @@ class TestCitekeyGeneration(TestRepo):
         c = self.repo.unique_citekey('Doe2013')
         self.assertEqual(c, 'Doe2013b')
 
+    def test_suffix_value(self):
+        for n in range(1000):
+            self.assertEqual(_base27_value(_base27(n)), n)
+        self.assertIsNone(_base27_value('A'))
+
+    def test_generated_keys_in_bulk(self):
+        for n in range(60):
+            c = self.repo.unique_citekey('Doe2013')
+            self.assertEqual(c, 'Doe2013' + _base27(n))
+            self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry,
+                                                     citekey=c))
+        self.assertEqual(self.repo.unique_citekey('Doe2013'), 'Doe2013bh')
+
+    def test_removed_key_is_reused(self):
+        for c in ('Doe2013', 'Doe2013a', 'Doe2013b'):
+            self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry,
+                                                     citekey=c))
+        self.assertEqual(self.repo.unique_citekey('Doe2013'), 'Doe2013c')
+        self.repo.remove_paper('Doe2013a')
+        self.assertEqual(self.repo.unique_citekey('Doe2013'), 'Doe2013a')
+
+    def test_suffixes_read_from_citekey_index(self):
+        for c in ('Doe2013', 'Doe2013a', 'Doe2013c', 'Doe2013B', 'Doe2013b1'):
+            self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry,
+                                                     citekey=c))
+        repo = Repository(configs.Config())
+        self.assertEqual(repo.unique_citekey('Doe2013'), 'Doe2013b')
+        self.assertEqual(repo.unique_citekey('Doe'), 'Doe')
+
+    def test_suffixes_kept_across_runs(self):
+        for c in ('Doe2013', 'Doe2013thesis'):
+            self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry,
+                                                     citekey=c))
+        self.assertEqual(self.repo.unique_citekey('Doe2013'), 'Doe2013a')
+        for c in ('Doe2013a', 'Doe2013b'):
+            self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry,
+                                                     citekey=c))
+        self.repo.remove_paper('Doe2013a')
+        # the stamp of the bib directory is not racy
+        bibdir = self.fs['fs'].GetObject(self.repo.databroker.directory + '/bib')
+        bibdir.st_mtime = 0
+        self.repo.citekey_index.modified = True
+        self.repo.citekey_index.save()
+        repo = Repository(configs.Config())
+        repo.citekey_index.citekeys_from_prefix = None  # not scanned again
+        self.assertEqual(repo.unique_citekey('Doe2013'), 'Doe2013a')
+        repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry,
+                                            citekey='Doe2013a'))
+        self.assertEqual(repo.unique_citekey('Doe2013'), 'Doe2013c')
+
+
+class TestDecodeCache(TestRepo):
+
+    def test_repeated_pulls_are_decoded_once(self):
+        self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry))
+        repo = Repository(configs.Config())
+        papers = [repo.pull_paper('Doe2013') for _ in range(3)]
+        coder = repo.databroker.endecoder
+        self.assertEqual(coder.cache_misses, 2)
+        self.assertEqual(coder.cache_hits, 4)
+        self.assertEqual(papers[0], papers[2])
+
+
+class TestMembership(TestRepo):
+
+    def test_contains_without_listing(self):
+        repo = Repository(configs.Config())
+        self.assertTrue('turing1950computing' in repo)
+        self.assertFalse('Doe2013' in repo)
+        repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry))
+        self.assertTrue('Doe2013' in repo)
+        self.assertIsNone(repo._citekeys)
+
+    def test_contains_with_listing(self):
+        self.assertEqual(self.repo.citekeys, set(['turing1950computing']))
+        self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry))
+        self.assertTrue('Doe2013' in self.repo)
+        self.repo.remove_paper('turing1950computing')
+        self.assertFalse('turing1950computing' in self.repo)
+        self.assertEqual(self.repo.citekeys, set(['Doe2013']))
+
+
+class TestBatch(TestRepo):
+
+    def setUp(self):
+        super(TestBatch, self).setUp()
+        self.sent = []
+        events._listener.append((events.AddEvent, self.sent.append, ()))
+
+    def tearDown(self):
+        events._listener.pop()
+        super(TestBatch, self).tearDown()
+
+    def test_events_after_commit(self):
+        self.repo.index
+        with self.repo.batch():
+            self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry))
+            with self.repo.batch():
+                self.repo.push_paper(Paper.from_bibentry(fixtures.page_bibentry))
+            self.assertEqual(self.sent, [])
+            self.assertTrue(self.repo.index.modified)
+        self.assertEqual([e.citekey for e in self.sent], ['Doe2013', 'Page99'])
+        self.assertFalse(self.repo.index.modified)
+        self.assertEqual(Repository(configs.Config()).index.citekeys(),
+                         set(['turing1950computing', 'Doe2013', 'Page99']))
+
+    def test_failed_batch_sends_events_of_landed_writes(self):
+        self.repo.index
+        with self.assertRaises(CiteKeyCollision):
+            with self.repo.batch():
+                self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry))
+                self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry))
+        self.assertEqual([e.citekey for e in self.sent], ['Doe2013'])
+        self.assertFalse(self.repo.index.modified)
+        self.assertTrue('Doe2013' in Repository(configs.Config()).index.citekeys())
+        self.repo.push_paper(Paper.from_bibentry(fixtures.page_bibentry))
+        self.assertEqual([e.citekey for e in self.sent], ['Doe2013', 'Page99'])
+
 
 class TestPushPaper(TestRepo):
 
@@ -65,6 +184,24 @@ class TestPushPaper(TestRepo):
         self.assertTrue(now < retrieved['added'])
 
 
+class TestJSONMetadata(TestRepo):
+
+    def test_yaml_metadata_migrated_on_push(self):
+        paper = self.repo.pull_paper('turing1950computing')
+        raw = self.repo.databroker.databroker.filebroker.pull_metafile(
+            'turing1950computing')
+        self.assertFalse(raw.startswith('{'))
+
+        repo = Repository(configs.Config(metadata_format='json'))
+        self.assertEqual(repo.pull_paper('turing1950computing'), paper)
+        paper.add_tag('computing')
+        repo.push_paper(paper, overwrite=True)
+        raw = repo.databroker.databroker.filebroker.pull_metafile(
+            'turing1950computing')
+        self.assertTrue(raw.startswith('{'))
+        self.assertEqual(self.repo.pull_paper('turing1950computing'), paper)
+
+
 class TestUpdatePaper(TestRepo):
 
     def test_updates_same_key(self):
@@ -88,5 +225,54 @@ class TestUpdatePaper(TestRepo):
     # TODO: should also check that associated files are updated
 
 
+class TestPullPapers(TestRepo):
+
+    def test_pulls_all_papers(self):
+        self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry))
+        papers = list(self.repo.pull_papers())
+        self.assertEqual(set(p.citekey for p in papers),
+                         set(['turing1950computing', 'Doe2013']))
+        for p in papers:
+            self.assertEqual(p, self.repo.pull_paper(p.citekey))
+
+    def test_pulls_papers_in_order(self):
+        self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry))
+        citekeys = ['Doe2013', 'turing1950computing']
+        self.assertEqual([p.citekey for p in self.repo.pull_papers(citekeys)],
+                         citekeys)
+        self.assertEqual([p.citekey for p in self.repo.pull_papers(citekeys[::-1])],
+                         citekeys[::-1])
+
+    def test_raises_on_unknown_citekey(self):
+        with self.assertRaises(InvalidReference):
+            list(self.repo.pull_papers(['turing1950computing', 'Page99']))
+
+    def test_lazy_papers_only_read_metafiles(self):
+        self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry))
+        pulled = []
+        pull_bibentry = self.repo.databroker.pull_bibentry
+
+        def counting_pull(citekey):
+            pulled.append(citekey)
+            return pull_bibentry(citekey)
+        self.repo.databroker.pull_bibentry = counting_pull
+        papers = list(self.repo.pull_papers(lazy=True))
+        paper = self.repo.pull_paper('Doe2013', lazy=True)
+        self.assertEqual(set(p.citekey for p in papers),
+                         set(['turing1950computing', 'Doe2013']))
+        self.assertEqual(pulled, [])
+        self.assertEqual(paper.bibdata, fixtures.doe_bibentry['Doe2013'])
+        self.assertEqual(pulled, ['Doe2013'])
+        for p in papers:
+            self.assertEqual(p, self.repo.pull_paper(p.citekey))
+
+    def test_uncached_pull_skips_snapshot(self):
+        self.repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry))
+        repo = Repository(configs.Config())
+        papers = list(repo.pull_papers(cached=False))
+        self.assertEqual(papers, list(self.repo.pull_papers()))
+        self.assertIsNone(repo.databroker._snapshot)
+
+
 if __name__ == '__main__':
     unittest.main()
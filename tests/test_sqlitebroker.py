@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+import os
+
+import dotdot
+
+from pubs import sqlitebroker, filebroker, databroker, endecoder, configs, events
+from pubs.repo import Repository, CiteKeyCollision
+from pubs.paper import Paper
+
+import str_fixtures
+import fixtures
+
+
+class TestSQLiteBroker(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmpdir, 'repo')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_pushpull(self):
+        sb = sqlitebroker.SQLiteBroker(self.directory, create=True)
+
+        sb.push_metafile('citekey1', 'abc')
+        sb.push_bibfile('citekey1', u'cdéf')
+
+        self.assertEqual(sb.pull_metafile('citekey1'), 'abc')
+        self.assertEqual(sb.pull_bibfile('citekey1'), u'cdéf')
+
+        sb.push_bibfile('citekey1', 'ghi')
+        self.assertEqual(sb.pull_bibfile('citekey1'), 'ghi')
+        self.assertEqual(sb.stat_bibfile('citekey1').st_size, 3)
+
+    def test_errors(self):
+        with self.assertRaises(IOError):
+            sqlitebroker.SQLiteBroker(self.directory, create=False)
+
+        sb = sqlitebroker.SQLiteBroker(self.directory, create=True)
+        self.assertFalse(sb.exists('Page99'))
+        with self.assertRaises(IOError):
+            sb.pull_bibfile('Page99')
+        with self.assertRaises(IOError):
+            sb.pull_metafile('Page99')
+        with self.assertRaises(IOError):
+            sb.stat_metafile('Page99')
+
+    def test_remove(self):
+        sb = sqlitebroker.SQLiteBroker(self.directory, create=True)
+        sb.push('citekey1', 'defg', 'abc')
+        self.assertTrue(sb.exists('citekey1', meta_check=True))
+
+        sb.remove('citekey1')
+        self.assertFalse(sb.exists('citekey1'))
+        with self.assertRaises(IOError):
+            sb.pull_metafile('citekey1')
+
+    def test_persistence(self):
+        sb = sqlitebroker.SQLiteBroker(self.directory, create=True)
+        sb.push_bibfile('citekey1', 'abc')
+        sb.close()
+        sb = sqlitebroker.SQLiteBroker(self.directory)
+        self.assertEqual(sb.pull_bibfile('citekey1'), 'abc')
+        self.assertTrue(sb.exists('citekey1'))
+        self.assertFalse(sb.exists('citekey1', meta_check=True))
+
+    def test_listing(self):
+        sb = sqlitebroker.SQLiteBroker(self.directory, create=True)
+        sb.push('citekey1', 'a', 'b')
+        sb.push_bibfile('citekey2', 'cd')
+        self.assertEqual(set(sb.citekeys()), {'citekey1', 'citekey2'})
+        listing = sb.listing(filestats=False)
+        self.assertEqual(listing['metafiles'], ['citekey1'])
+        self.assertEqual(set(listing['bibfiles']), {'citekey1', 'citekey2'})
+        listing = sb.listing(filestats=True)
+        sizes = dict((c, s.st_size) for c, s in zip(listing['bibfiles'],
+                                                    listing['bibstats']))
+        self.assertEqual(sizes, {'citekey1': 1, 'citekey2': 2})
+
+    def test_batch_rollback(self):
+        sb = sqlitebroker.SQLiteBroker(self.directory, create=True)
+        sb.push_bibfile('citekey1', 'abc')
+        with self.assertRaises(ValueError):
+            with sb.batch():
+                sb.push_bibfile('citekey2', 'abc')
+                with sb.batch():
+                    sb.remove('citekey1')
+                raise ValueError()
+        self.assertEqual(sb.citekeys(), ['citekey1'])
+
+    def test_copy_files(self):
+        fb = filebroker.FileBroker(self.directory, create=True)
+        fb.push('citekey1', 'a', 'b')
+        fb.push_bibfile('citekey2', 'cd')
+        sb = sqlitebroker.SQLiteBroker(self.directory, create=True)
+        self.assertEqual(databroker.copy_files(fb, sb), {'citekey1', 'citekey2'})
+        self.assertEqual(sb.pull_metafile('citekey1'), 'a')
+        self.assertEqual(sb.pull_bibfile('citekey2'), 'cd')
+
+    def test_databroker(self):
+        ende = endecoder.EnDecoder()
+        page99_metadata = ende.decode_metadata(str_fixtures.metadata_raw0)
+        page99_bibentry = ende.decode_bibdata(str_fixtures.bibtex_raw0)
+
+        db = databroker.DataBroker(self.directory, create=True, storage='sqlite')
+        db.push_metadata('citekey1', page99_metadata)
+        db.push_bibentry('citekey1', page99_bibentry)
+        self.assertEqual(db.citekeys(), {'citekey1'})
+        self.assertEqual(db.pull_metadata('citekey1'), page99_metadata)
+        self.assertEqual(db.pull_bibentry('citekey1'), page99_bibentry)
+
+    def test_failed_batch_drops_events(self):
+        config = configs.Config()
+        config.pubsdir = self.directory
+        config.storage = 'sqlite'
+        repo = Repository(config, create=True)
+        repo.index
+        sent = []
+        events._listener.append((events.AddEvent, sent.append, ()))
+        try:
+            with self.assertRaises(CiteKeyCollision):
+                with repo.batch():
+                    repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry))
+                    repo.push_paper(Paper.from_bibentry(fixtures.doe_bibentry))
+        finally:
+            events._listener.pop()
+        self.assertEqual(sent, [])
+        self.assertIsNone(repo._index)
+        self.assertEqual(repo.citekeys, set())
+        self.assertEqual(repo.index.citekeys(), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,6 +9,7 @@ import fake_env
 
 from pubs import pubs_cmd
 from pubs import color, content, filebroker, uis, p3, endecoder, configs
+from pubs import __version__
 
 import str_fixtures
 import fixtures
@@ -221,6 +222,22 @@ class TestList(DataCommandTestCase):
         # Last added should be last
         self.assertEqual('[Page99]', outs[4].splitlines()[-1][:8])
 
+    def test_list_limit_reverse(self):
+        cmds = ['pubs init',
+                'pubs import data/',
+                'pubs list -k -a',
+                'pubs list -k -a --reverse',
+                'pubs list -k -a --limit 2',
+                'pubs list -k -a -r -n 2',
+                'pubs list --limit 1',
+                ]
+        outs = self.execute_cmds(cmds)
+        citekeys = outs[2].splitlines()
+        self.assertEqual(outs[3].splitlines(), citekeys[::-1])
+        self.assertEqual(outs[4].splitlines(), citekeys[:2])
+        self.assertEqual(outs[5].splitlines(), citekeys[::-1][:2])
+        self.assertEqual(1, len(outs[6].splitlines()))
+
     def test_list_smart_case(self):
         cmds = ['pubs init',
                 'pubs list',
@@ -440,6 +457,20 @@ class TestUsecase(DataCommandTestCase):
         self.assertEqual(endecoder.EnDecoder().decode_bibdata(outs[2]),
                          fixtures.page_bibentry)
 
+    def test_export_output(self):
+        cmds = ['pubs init',
+                ('pubs add', [str_fixtures.bibtex_external0]),
+                ('pubs add', [str_fixtures.turing_bib]),
+                'pubs export',
+                'pubs export -o export.bib',
+               ]
+        outs = self.execute_cmds(cmds)
+        self.assertEqual(outs[4], '')
+        exported = content.read_file('export.bib')
+        self.assertEqual(exported, outs[3])
+        bibentries = endecoder.EnDecoder().decode_bibdata(exported)
+        self.assertEqual(set(bibentries), set(['Page99', 'turing1950computing']))
+
     def test_import(self):
         cmds = ['pubs init',
                 'pubs import data/',
@@ -458,6 +489,16 @@ class TestUsecase(DataCommandTestCase):
         outs = self.execute_cmds(cmds)
         self.assertEqual(1 + 1, len(outs[-1].split('\n')))
 
+    def test_import_duplicated_entries(self):
+        bib = str_fixtures.bibtex_raw0
+        content.write_file('dup.bib', bib + '\n' + bib.replace(
+            'The PageRank Citation Ranking', 'The PageRank Ranking'))
+        outs = self.execute_cmds(['pubs init',
+                                  'pubs import dup.bib',
+                                  'pubs list'])
+        self.assertEqual(1 + 1, len(outs[-1].split('\n')))
+        self.assertIn('The PageRank Ranking', outs[-1])
+
     def test_open(self):
         cmds = ['pubs init',
                 'pubs add data/pagerank.bib',
@@ -480,6 +521,33 @@ class TestUsecase(DataCommandTestCase):
         with self.assertRaises(SystemExit):
             self.execute_cmds(cmds)
 
+    def test_update_deprecated_version(self):
+        self.execute_cmds(['pubs init'])
+        conf = configs.Config()
+        conf.load()
+        conf.version = '3'
+        conf.save()
+        self.execute_cmds([('pubs update', ['y'])])
+        conf = configs.Config()
+        conf.load()
+        self.assertEqual(conf.version, __version__)
+
+    def test_update_layout(self):
+        cmds = ['pubs init',
+                'pubs add data/pagerank.bib',
+                ('pubs update --layout sharded', ['y']),
+                'pubs add data/turing1950.bib',
+                'pubs list',
+                ('pubs update --layout flat', ['y']),
+                'pubs list',
+               ]
+        outs = self.execute_cmds(cmds)
+        self.assertEqual(2, len(outs[4].splitlines()))
+        self.assertEqual(outs[4], outs[6])
+        bib_dir = self.fs['os'].path.join(self.default_pubs_dir, 'bib')
+        self.assertEqual(set(self.fs['os'].listdir(bib_dir)),
+                         {'Page99.bib', 'turing1950computing.bib'})
+
     def test_add_with_tag(self):
         cmds = ['pubs init',
                 'pubs add data/pagerank.bib --tags junk',